@@ -1,9 +1,9 @@
-import requests
-import json
+import uuid
 import api
 
 # Re-export API entities
 from api import Product, Order, Shipment, Payment, Customer
+from client import deadline, DeadlineExceeded, CircuitOpen
 
 
 import logging
@@ -12,17 +12,17 @@ logger = logging.getLogger('airbrite')
 
 def _get(resource):
     logger.debug('REST API call - _get(%s)' % resource)
-    return requests.get(api.END_POINT + resource,
-                        auth=(api.KEY, api.KEY_PASSWORD))
+    return api.Entity.client.request('get', api.END_POINT + resource)
 
 
-def _post(resource, data={}):
+def _post(resource, data={}, idempotency_key=None):
     url = api.END_POINT + resource
-    headers = {'content-type': 'application/json'}
-    payload = json.dumps(data)
+    headers = {'content-type': 'application/json',
+               'Idempotency-Key': idempotency_key or str(uuid.uuid4())}
+    payload = api.Entity.client.codec.dumps(data)
     logger.debug('REST API call - _post(%s)' % resource)
-    return requests.post(url, auth=(api.KEY, api.KEY_PASSWORD),
-                         headers=headers, data=payload)
+    return api.Entity.client.request('post', url, headers=headers,
+                                     data=payload)
 
 
 def test_connection():
@@ -41,30 +41,18 @@ def test_connection():
 
 def get_product(product_id):
     """Returns an api.Product object for the provided ID"""
-
-    response = _get('products/' + product_id)
-    if response.status_code != 200:
-        error_msg = response.json()['data']
-        logger.error('get_product() failed with "%s"' % error_msg)
+    try:
+        return api.Product.fetch(_id=product_id)
+    except (DeadlineExceeded, CircuitOpen):
+        raise
+    except Exception as e:
+        logger.error('get_product() failed with "%s"' % e)
         raise Exception('Product not found')
-    product_data = response.json()[u'data']
-    return api.Product(product_data)
-
 
-def get_products():
-    """Returns an iterable of api.Product objects"""
 
-    response = _get('products')
-    if response.status_code != 200:
-        error_msg = response.json()['data']
-        logger.error('get_products() failed with "%s"' % error_msg)
-        # TODO: make this a critical error
-        raise Exception('Products endpoint failed')
-
-    # TODO: adapt to pagination
-    data = response.json()
-    for product_data in data[u'data']:
-        yield api.Product(product_data)
+def get_products(**filters):
+    """Returns an iterable of api.Product objects, walking every page"""
+    return api.Product.iter_all(**filters)
 
 
 ###############################################################################
@@ -83,7 +71,13 @@ def payment(card_token='', amount=0, gateway="stripe", currency="usd"):
     }
 
 
-def new_order(sku='', quantity=0, line_items=[], payments=[]):
+def new_order(sku='', quantity=0, line_items=[], payments=[],
+              idempotency_key=None):
+    """Places an order, returns it as an api.Order object.
+
+    Pass the same `idempotency_key` when retrying the order, so that it
+    isn't placed (and charged) twice.
+    """
     # TODO: Generalize the payload generation
     if sku and quantity:
         payload = {
@@ -103,10 +97,11 @@ def new_order(sku='', quantity=0, line_items=[], payments=[]):
     if payments:
         payload['payments'] = payments
 
-    response = _post('orders', data=payload)
+    response = _post('orders', data=payload, idempotency_key=idempotency_key)
+    body = api.Entity.client.codec.decode(response)
     if response.status_code != 200:
-        error_msg = response.json()['data']
+        error_msg = body['data']
         logger.error('new_order() failed with "%s"' % error_msg)
         raise Exception('Order could not be placed')
 
-    return api.Order(response.json()['data'])
+    return api.Order(body['data'])
@@ -2,8 +2,12 @@
 
 from datetime import datetime
 from copy import copy
+import collections
+import concurrent.futures
+import itertools
 import logging
 import calendar
+import marshal
 
 
 END_POINT = 'https://api.airbrite.io/v2'
@@ -26,33 +30,84 @@ class APIAttribute (object):
         self.name = attribute_api_name
 
     def __get__(self, instance, owner):
-        if self.name not in instance._data:
-            instance._data[self.name] = copy(self.default)
-        return instance._data[self.name]
+        return instance._get_field(self.name, self.default)
 
     def __set__(self, instance, value):
-        instance._data[self.name] = value
+        instance._set_field(self.name, value)
+        instance._changed(self.name)
+
+
+def _utc_datetime(timestamp):
+    """Returns the Unix timestamp as a naive UTC datetime"""
+    if timestamp is None:
+        return None
+    return datetime.utcfromtimestamp(timestamp)
+
+
+def _iso_date(value):
+    """Returns the datetime in the API's ISO 8601 format, in UTC"""
+    if value.utcoffset() is not None:
+        value = value.replace(tzinfo=None) - value.utcoffset()
+    return '%s.%03dZ' % (value.strftime('%Y-%m-%dT%H:%M:%S'),
+                         value.microsecond // 1000)
 
 
 class DateAPIAttribute (APIAttribute):
-    # TODO fix datetime and ISO conversions to match exacly
+    """A Unix timestamp in the API, a datetime in Python.
+
+    Datetimes are naive and in UTC; aware ones are converted when set. Each
+    instance memoizes the datetimes it handed out, until the timestamp
+    changes.
+    """
 
     def __get__(self, instance, owner):
         """Returns a datetime object."""
         timestamp = super(DateAPIAttribute, self).__get__(instance, owner)
+        dates = instance._dates
+        if dates is not None:
+            cached = dates.get(self.name)
+            if cached is not None and cached[0] == timestamp:
+                return cached[1]
+        else:
+            dates = instance._dates = {}
         # Transform the timestamp to a datetime object
-        return datetime.fromtimestamp(timestamp)
+        value = _utc_datetime(timestamp)
+        dates[self.name] = (timestamp, value)
+        return value
 
     def __set__(self, instance, value):
         # Transform the datetime object to a timestamp
         timestamp = calendar.timegm(value.utctimetuple())
         super(DateAPIAttribute, self).__set__(instance, timestamp)
+        if instance._dates is not None:
+            instance._dates.pop(self.name, None)
 
         # Update the corresponding API attribute for *_date (ISO 8601), if any
         _date_name = self.name + '_date'
-        if _date_name in instance._data:
-            iso_date = value.isoformat()
-            instance._data[_date_name] = iso_date
+        if instance._has_field(_date_name):
+            instance._set_field(_date_name, _iso_date(value))
+            instance._changed(_date_name)
+
+
+def datetimes(entities, name='created'):
+    """Returns the `name` date of each entity, as DateAPIAttribute does.
+
+    Each distinct timestamp is converted once, and the datetimes are
+    memoized in the entities, so sorting or bucketing them by date
+    afterwards allocates nothing more.
+    """
+    converted = {}
+    results = []
+    for entity in entities:
+        timestamp = entity._get_field(name)
+        value = converted.get(timestamp)
+        if value is None:
+            value = converted[timestamp] = _utc_datetime(timestamp)
+        if entity._dates is None:
+            entity._dates = {}
+        entity._dates[name] = (timestamp, value)
+        results.append(value)
+    return results
 
 
 ###############################################################################
@@ -60,8 +115,10 @@ class DateAPIAttribute (APIAttribute):
 class EntityCollection (list):
     """Proxy to an underlying list and transform entities on the fly"""
 
-    def __init__(self, entity, values=[]):
+    def __init__(self, entity, values=[], changed=None):
+        """`changed` is called whenever the collection is modified"""
         self.entity = entity
+        self.changed = changed
         self.reset(values)
 
     def reset(self, values):
@@ -80,6 +137,7 @@ class EntityCollection (list):
         if not isinstance(entity, self.entity):
             raise TypeError('must receive a %s object' % self.entity)
         self.collection.append(entity.to_dict())
+        self._changed()
 
     def remove(self, entity):
         if not isinstance(entity, self.entity):
@@ -87,6 +145,11 @@ class EntityCollection (list):
         if not entity._id:
             raise ValueError('%s object does not have an _id' % self.entity)
         self.collection.remove(entity.to_dict())
+        self._changed()
+
+    def _changed(self):
+        if self.changed is not None:
+            self.changed()
 
     def __len__(self):
         return len(self.collection)
@@ -98,9 +161,11 @@ class EntityCollection (list):
         if not isinstance(value, self.entity):
             raise TypeError('must receive a %s object' % self.entity)
         self.collection[index] = value.to_dict()
+        self._changed()
 
     def __delitem__(self, index):
         self.collection.__delitem__(index)
+        self._changed()
 
     def __iter__(self):
         for datum in self.collection:
@@ -122,14 +187,15 @@ class APICollectionAttribute (object):
         self.entity = entity
 
     def __get__(self, instance, owner):
-        if self.name not in instance._data:
-            instance._data[self.name] = []
-        return EntityCollection(self.entity, instance._data[self.name])
+        return EntityCollection(self.entity,
+                                instance._get_field(self.name, []),
+                                changed=lambda: instance._changed(self.name))
 
     def __set__(self, instance, values):
+        instance._changed(self.name)
         if isinstance(values, EntityCollection):
             # Reset the values to those proxied by the collection
-            instance._data[self.name] = values.collection
+            instance._set_field(self.name, values.collection)
         else:
 
             if isinstance(values, list):
@@ -138,7 +204,7 @@ class APICollectionAttribute (object):
                     values = [v.to_dict() for v in values]
 
                 # Set the list of values
-                instance._data[self.name] = values
+                instance._set_field(self.name, values)
 
             # In any other case, error out
             else:
@@ -147,10 +213,189 @@ class APICollectionAttribute (object):
 
 ###############################################################################
 
+# Marks the fields absent from a compact entity
+_MISSING = object()
+
+
+def _digest(value):
+    """Fingerprints a dict or list of JSON values, None if it can't"""
+    try:
+        return hash(marshal.dumps(value))
+    except ValueError:
+        return None
+
+
+class EntitySchema (type):
+    """Compiles the API attributes declared by an entity class (and its
+    bases) into a schema: the `_fields` it knows, at their `_index`, and
+    the `_defaults` of the attributes. The `_kind` names the entities of
+    the class and of its compact variant alike.
+    """
+
+    def __init__(cls, name, bases, namespace):
+        super(EntitySchema, cls).__init__(name, bases, namespace)
+        fields = []
+        defaults = {}
+        for klass in reversed(cls.__mro__):
+            for attr_name, attr in sorted(vars(klass).items()):
+                if isinstance(attr, DateAPIAttribute):
+                    names = (attr.name, attr.name + '_date')
+                elif isinstance(attr, APIAttribute):
+                    names = (attr.name,)
+                    defaults[attr.name] = attr.default
+                elif isinstance(attr, APICollectionAttribute):
+                    names = (attr.name,)
+                    defaults[attr.name] = []
+                else:
+                    continue
+                fields.extend(n for n in names if n not in fields)
+        cls._fields = tuple(fields)
+        cls._defaults = defaults
+        if '_kind' not in namespace:
+            cls._kind = name
+        cls._index = dict((field, i) for i, field in enumerate(fields))
+
+    def compact(cls):
+        """Returns the compact variant of the entity class.
+
+        Its instances keep their data in a list laid out by the schema,
+        instead of in a dict of their own, and take a fraction of the
+        memory; they behave like instances of the class otherwise.
+        """
+        if issubclass(cls, CompactLayout):
+            return cls
+        compact = cls.__dict__.get('_compact')
+        if compact is None:
+            compact = EntitySchema('Compact' + cls.__name__,
+                                   (CompactLayout, cls),
+                                   {'__slots__': (),
+                                    '__module__': cls.__module__,
+                                    '_kind': cls._kind})
+            cls._compact = compact
+        return compact
+
+
+class CompactLayout (object):
+    """Slot-backed storage of entity data.
+
+    The fields of the schema are kept in `_values`, at their index (or
+    _MISSING), and any other field in `_extra`, as (name, value) pairs.
+    `_data` is rebuilt on access, so it must not be modified in place.
+    Instances get no `__dict__`, unless something sets an undeclared
+    attribute on them.
+    """
+
+    __slots__ = ('_values', '_extra', '_baseline', '_dirty', '_dates')
+
+    @property
+    def _data(self):
+        data = dict(pair for pair in itertools.izip(self._fields,
+                                                    self._values)
+                    if pair[1] is not _MISSING)
+        data.update(self._extra)
+        return data
+
+    @_data.setter
+    def _data(self, data):
+        index = self._index
+        values = [_MISSING] * len(index)
+        extra = []
+        for name, value in data.iteritems():
+            i = index.get(name)
+            if i is None:
+                extra.append((name, value))
+            else:
+                values[i] = value
+        self._values = values
+        self._extra = tuple(extra)
+
+    def _get_field(self, name, default=None):
+        i = self._index.get(name)
+        if i is None:
+            data = self._data
+            value = data.setdefault(name, copy(default))
+            self._data = data
+            return value
+        value = self._values[i]
+        if value is _MISSING:
+            value = self._values[i] = copy(default)
+        return value
+
+    def _set_field(self, name, value):
+        i = self._index.get(name)
+        if i is None:
+            self._extra = tuple((n, v) for n, v in self._extra
+                                if n != name) + ((name, value),)
+        else:
+            self._values[i] = value
+
+    def _has_field(self, name):
+        i = self._index.get(name)
+        if i is None:
+            return any(n == name for n, _ in self._extra)
+        return self._values[i] is not _MISSING
+
+    def __reduce__(self):
+        # Compact classes are built on demand, so pickle the regular one
+        regular = [c for c in self.__class__.__mro__
+                   if not issubclass(c, CompactLayout)][0]
+        return _compact_entity, (regular, self._data)
+
+
+def _compact_entity(cls, data):
+    """Unpickles a compact entity of the class"""
+    instance = cls.compact().__new__(cls.compact())
+    instance._data = data
+    instance._baseline = instance._dirty = instance._dates = None
+    return instance
+
+
+###############################################################################
+
+def _gather(client, fn, items, concurrency):
+    """Calls `fn` on every item, with up to `concurrency` calls in flight.
+
+    Returns a (result, exception) pair per item, in input order; a failing
+    call does not stop the others.
+    """
+    outcomes = [None] * len(items)
+    remaining = iter(enumerate(items))
+    pending = {}
+
+    def schedule():
+        for index, item in remaining:
+            pending[client.submit(fn, item)] = index
+            return True
+        return False
+
+    while len(pending) < max(concurrency, 1) and schedule():
+        pass
+    while pending:
+        done, _ = concurrent.futures.wait(
+            pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            index = pending.pop(future)
+            try:
+                outcomes[index] = (future.result(), None)
+            except Exception as e:
+                outcomes[index] = (None, e)
+            schedule()
+    return outcomes
+
+
+def _report(outcomes):
+    """Split `_gather` outcomes into results and errors by index"""
+    results = [result for result, _ in outcomes]
+    errors = dict((index, error)
+                  for index, (_, error) in enumerate(outcomes) if error)
+    return results, errors
+
 
 class Entity (object):
     """Base class for airbrite objects"""
 
+    __metaclass__ = EntitySchema
+
     _id = APIAttribute('_id')
     user_id = APIAttribute('user_id')
     created = DateAPIAttribute('created')
@@ -161,6 +406,19 @@ class Entity (object):
     client = client.Client()
     class_url = ''
 
+    # Optional cache.EntityCache, consulted by `fetch` and `refresh`
+    cache = None
+
+    # Digests of the dict and list fields as last synced with the backend,
+    # as a flat (name, digest, ...) tuple; None when unknown
+    _baseline = None
+
+    # Names of the fields assigned since, or None
+    _dirty = None
+
+    # Datetimes handed out by the DateAPIAttributes, with their timestamps
+    _dates = None
+
     logger = logging.getLogger('airbrite.entities')
 
     def instance_url(self):
@@ -175,16 +433,88 @@ class Entity (object):
     def __init__(self, **kwargs):
         self.replace(kwargs)
 
+    @classmethod
+    def _key_kwargs(cls, key):
+        """Turn a key, as taken by the bulk methods, into identifying
+        keyword arguments.
+        """
+        return {'_id': key}
+
     @property
     def id(self):
         return self._id
 
     def replace(self, data={}):
         self._data = data
+        self._baseline = self._dirty = self._dates = None
 
     def to_dict(self):
         return self._data
 
+    @classmethod
+    def _from_backend(cls, data):
+        """Returns an instance of the data, as the backend sent it"""
+        instance = cls(**data)
+        instance._synced()
+        return instance
+
+    # Change tracking
+
+    def _synced(self):
+        """The data is the backend's, track the changes from now on.
+
+        Assignments are recorded as they happen. Dicts and lists may be
+        changed in place, so they are fingerprinted now and compared in
+        `changes`, and reading them costs nothing.
+        """
+        baseline = []
+        for name, value in self.to_dict().iteritems():
+            if isinstance(value, (dict, list)):
+                baseline += (name, _digest(value))
+        self._baseline = tuple(baseline)
+        self._dirty = None
+
+    def _changed(self, name):
+        if self._baseline is not None:
+            if self._dirty is None:
+                self._dirty = set()
+            self._dirty.add(name)
+
+    def changes(self):
+        """Returns the fields changed since the data was last synced with
+        the backend, with their values; None if that's unknown.
+        """
+        if self._baseline is None:
+            return None
+        data = self.to_dict()
+        changed = set(name for name in self._dirty or () if name in data)
+        synced = dict(itertools.izip(self._baseline[::2],
+                                     self._baseline[1::2]))
+        for name, value in data.iteritems():
+            if name in changed or not isinstance(value, (dict, list)):
+                continue
+            if name in synced:
+                digest = synced[name]
+                if digest is None or _digest(value) != digest:
+                    changed.add(name)
+            elif value != self._defaults.get(name):
+                # Not sent by the backend, and no longer the default
+                changed.add(name)
+        return dict((name, data[name]) for name in changed)
+
+    # Field storage, overridden by CompactLayout
+
+    def _get_field(self, name, default=None):
+        if name not in self._data:
+            self._data[name] = copy(default)
+        return self._data[name]
+
+    def _set_field(self, name, value):
+        self._data[name] = value
+
+    def _has_field(self, name):
+        return name in self._data
+
     def __eq__(self, other):
         if self._id and hasattr(other, '_id'):
             return self._id == other._id
@@ -206,19 +536,85 @@ class Fetchable (object):
         instance.refresh()
         return instance
 
-    def refresh(self):
+    def refresh(self, cached=True):
+        """Replace the contents with the backend's (or the cache's) data.
+
+        Pass `cached=False` to always go to the backend. Local changes
+        are discarded. When there are none, the request is conditional on
+        the `updated` timestamp held, and the current data is kept if the
+        backend reports the entity as not modified.
+        """
         if not self.is_persisted:
             raise Exception('refreshing non-saved airbrite entity')
-        data = self.client.get(self.instance_url())
-        self.replace(data['data'])
+        url = self.instance_url()
+        data = None
+        if cached and self.cache is not None:
+            data = self.cache.get(self.__class__, url)
+        if data is None:
+            # Revalidate the data we hold, rather than downloading it again,
+            # if it is known to be the backend's
+            updated = None
+            if self.changes() == {}:
+                updated = self._data.get('updated')
+            try:
+                response = self.client.get_if_modified(url, updated=updated)
+            except client.CircuitOpen:
+                # Airbrite is failing, fall back to the cache, even stale
+                if self.cache is None:
+                    raise
+                data = self.cache.get(self.__class__, url, stale=True)
+                if data is None:
+                    raise
+                self.logger.warning('refresh() served %s from the cache, the'
+                                    ' circuit is open' % url)
+                self.replace(data)
+                self._synced()
+                return
+            # Not modified, the data we hold is current
+            data = self._data if response is None else response['data']
+            if self.cache is not None:
+                self.cache.set(self.__class__, url, data)
+        self.replace(data)
+        self._synced()
+
+    @classmethod
+    def afetch(cls, **kwargs):
+        """Like `fetch`, but returns a Future for the instance"""
+        return cls.client.submit(cls.fetch, **kwargs)
+
+    def arefresh(self):
+        """Like `refresh`, but returns a Future for the refreshed self"""
+        def _refresh():
+            self.refresh()
+            return self
+        return self.client.submit(_refresh)
+
+    @classmethod
+    def fetch_many(cls, keys, concurrency=10):
+        """Fetch many entities, with up to `concurrency` requests in flight.
+
+        Returns the fetched entities in the order of `keys` (None for those
+        that failed) and a dict of the exceptions raised, by key.
+        """
+        keys = list(keys)
+        outcomes = _gather(cls.client,
+                           lambda key: cls.fetch(**cls._key_kwargs(key)),
+                           keys, concurrency)
+        results = [result for result, _ in outcomes]
+        errors = dict((key, error)
+                      for key, (_, error) in zip(keys, outcomes) if error)
+        return results, errors
 
 
 class Listable (object):
-    """Mixin to get `list`"""
+    """Mixin to get `list` and `iter_all`"""
 
     FILTERS = [('limit', int), ('offset', int), ('sort', str),
                ('order', str), ('since', int), ('until', int)]
 
+    # Page size used by `iter_all` when no `limit` is given
+    PAGE_SIZE = 100
+
     @classmethod
     def _filters(cls, **kwargs):
         try:
@@ -233,33 +629,213 @@ class Listable (object):
         req = cls.client.get(cls.collection_url(**kwargs),
                              **cls._filters(**kwargs))
         cls.logger.debug('list() got from backend: %s' % req['data'])
-        results = [cls(**data) for data in req['data']]
+        results = [cls._from_backend(data) for data in req['data']]
         paging = req['paging']
         return results, paging
 
+    @classmethod
+    def stream(cls, **kwargs):
+        """Like `list`, but yields the entities while the response is
+        parsed, so the page is never held in memory all at once.
+
+        Returns an iterable, whose `paging` is set once it was consumed.
+        """
+        return cls.client.stream(cls.collection_url(**kwargs),
+                                 item=cls._from_backend,
+                                 **cls._filters(**kwargs))
+
+    @classmethod
+    def alist(cls, **kwargs):
+        """Like `list`, but returns a Future for the (results, paging)"""
+        return cls.client.submit(cls.list, **kwargs)
+
+    @classmethod
+    def iter_all(cls, prefetch=1, **kwargs):
+        """Yields every entity in the collection, one page at a time.
+
+        While a page is being consumed, up to `prefetch` following pages are
+        fetched in the background, so at most `prefetch + 1` pages are held
+        in memory at once.
+        """
+        limit = int(kwargs.pop('limit', cls.PAGE_SIZE))
+        offset = int(kwargs.pop('offset', 0))
+        pending = collections.deque()
+
+        def schedule():
+            page_offset = offset + len(pending) * limit
+            pending.append(cls.client.submit(cls.list, limit=limit,
+                                             offset=page_offset, **kwargs))
+
+        try:
+            schedule()
+            while pending:
+                results, paging = pending.popleft().result()
+                offset += limit
+                if results and paging.get('has_more', len(results) == limit):
+                    while len(pending) < max(prefetch, 1):
+                        schedule()
+                else:
+                    # Last page, drop any fetch past the end
+                    for future in pending:
+                        future.cancel()
+                    pending.clear()
+                for result in results:
+                    yield result
+        finally:
+            for future in pending:
+                future.cancel()
+
+    @classmethod
+    def list_all_parallel(cls, concurrency=4, ordered=True, **kwargs):
+        """Yields every entity in the collection, fetching pages concurrently.
+
+        The first page's `paging['total']` is used to plan the remaining
+        offset windows, which are fetched with up to `concurrency` requests
+        in flight. Results come in collection order, unless `ordered` is
+        False, in which case each page is yielded as soon as it arrives.
+        """
+        limit = int(kwargs.pop('limit', cls.PAGE_SIZE))
+        offset = int(kwargs.pop('offset', 0))
+
+        results, paging = cls.list(limit=limit, offset=offset, **kwargs)
+        for result in results:
+            yield result
+        if not results or not paging.get('has_more', True):
+            return
+
+        total = paging.get('total')
+        if total is None:
+            # Without a total the windows can't be planned, walk instead
+            for result in cls.iter_all(limit=limit, offset=offset + limit,
+                                       prefetch=concurrency, **kwargs):
+                yield result
+            return
+
+        offsets = iter(xrange(offset + limit, total, limit))
+        pending = collections.deque()
+
+        def schedule():
+            for page_offset in offsets:
+                pending.append(cls.client.submit(cls.list, limit=limit,
+                                                 offset=page_offset,
+                                                 **kwargs))
+                return True
+            return False
+
+        try:
+            while len(pending) < max(concurrency, 1) and schedule():
+                pass
+            while pending:
+                if ordered:
+                    done = [pending.popleft()]
+                else:
+                    done, _ = concurrent.futures.wait(
+                        pending,
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        pending.remove(future)
+                for future in done:
+                    schedule()
+                    for result in future.result()[0]:
+                        yield result
+        finally:
+            for future in pending:
+                future.cancel()
+
 
 class Persistable (object):
     """Mixin to get `create`, `save` and `is_persisted` functionality"""
 
+    # Whether `save` may send only the changed fields of persisted entities
+    PARTIAL_SAVE = True
+
     @classmethod
-    def create(cls, **kwargs):
-        data = cls.client.post(cls.collection_url(**kwargs), **kwargs)
+    def create(cls, idempotency_key=None, **kwargs):
+        data = cls.client.post(cls.collection_url(**kwargs),
+                               idempotency_key=idempotency_key, **kwargs)
         cls.logger.debug('create() got from backend: %s' % data)
-        return cls(**data['data'])
+        instance = cls._from_backend(data['data'])
+        instance._write_through()
+        return instance
+
+    def save(self, idempotency_key=None, full=False, **kwargs):
+        """Create the entity, or update it if persisted.
 
-    def save(self, **kwargs):
+        Updates send only the fields changed since the data was last synced
+        with the backend (nothing at all if none was), unless `full` is set
+        or the changes are unknown, in which case the whole entity is sent.
+        """
+        changes = None
         if not self.is_persisted:
             data = self.client.post(self.collection_url(**kwargs),
+                                    idempotency_key=idempotency_key,
                                     **self.to_dict())
         else:
-            data = self.client.put(self.instance_url(), **self.to_dict())
+            if self.PARTIAL_SAVE and not full:
+                changes = self.changes()
+            if changes is None:
+                data = self.client.put(self.instance_url(), **self.to_dict())
+            elif not changes:
+                self.logger.debug('save() skipped, nothing changed')
+                return
+            else:
+                data = self.client.put(self.instance_url(), **changes)
         self.logger.debug('save() from backend: %s' % data)
-        self.replace(data['data'])
+        if changes:
+            # Fields the backend didn't send back are unchanged
+            self.replace(dict(self.to_dict(), **data['data']))
+        else:
+            self.replace(data['data'])
+        self._synced()
+        self._write_through()
+
+    @classmethod
+    def acreate(cls, **kwargs):
+        """Like `create`, but returns a Future for the new instance"""
+        return cls.client.submit(cls.create, **kwargs)
+
+    def asave(self, **kwargs):
+        """Like `save`, but returns a Future for the saved self"""
+        def _save():
+            self.save(**kwargs)
+            return self
+        return self.client.submit(_save)
+
+    @classmethod
+    def create_many(cls, records, concurrency=10):
+        """Create an entity per dict in `records`, with up to `concurrency`
+        requests in flight.
+
+        Returns the created entities in the order of `records` (None for
+        those that failed) and a dict of the exceptions raised, by index.
+        """
+        records = list(records)
+        outcomes = _gather(cls.client, lambda record: cls.create(**record),
+                           records, concurrency)
+        return _report(outcomes)
+
+    @classmethod
+    def save_many(cls, entities, concurrency=10):
+        """Save every entity, with up to `concurrency` requests in flight.
+
+        Returns the saved entities in input order (None for those that
+        failed) and a dict of the exceptions raised, by index.
+        """
+        def _save(entity):
+            entity.save()
+            return entity
+        outcomes = _gather(cls.client, _save, list(entities), concurrency)
+        return _report(outcomes)
 
     @property
     def is_persisted(self):
         return self._id and not self._id == ''
 
+    def _write_through(self):
+        """Update the cached copy of this entity, if caching"""
+        if self.cache is not None and self.is_persisted:
+            self.cache.set(self.__class__, self.instance_url(), self._data)
+
 
 class PersistableInOrder (Persistable):
 
@@ -270,10 +846,12 @@ class PersistableInOrder (Persistable):
             raise Exception('need an order_id to create this entity')
         return super(PersistableInOrder, cls).create(**kwargs)
 
-    def save(self):
+    def save(self, idempotency_key=None, full=False):
         if not self.order_id:
             raise Exception('saving this entity requires a valid order_id')
-        super(PersistableInOrder, self).save(order_id=self.order_id)
+        super(PersistableInOrder, self).save(idempotency_key=idempotency_key,
+                                             full=full,
+                                             order_id=self.order_id)
 
     @property
     def is_persisted(self):
@@ -299,6 +877,11 @@ class Product (Fetchable, Listable, Persistable, Entity):
 class EntityInOrder (Entity):
     order_id = APIAttribute('order_id')
 
+    @classmethod
+    def _key_kwargs(cls, key):
+        order_id, _id = key
+        return {'order_id': order_id, '_id': _id}
+
     @classmethod
     def collection_url(cls, order_id=order_id, **kwargs):
         relative_url = cls.class_url % {'order_id': order_id}
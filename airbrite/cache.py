@@ -0,0 +1,88 @@
+"""Size-bounded LRU cache of entity data, with per-class TTLs.
+
+Enable it for every entity by setting the class-level cache:
+
+    airbrite.api.Entity.cache = EntityCache(maxsize=5000, ttl=60,
+                                            ttls={'Product': 3600})
+
+`fetch` and `refresh` are then served from the cache while the data is
+fresh, and `create`/`save` write the new data through.
+"""
+import collections
+import copy
+import threading
+import time
+
+
+class EntityCache (object):
+
+    def __init__(self, maxsize=1000, ttl=60, ttls=None, clock=time.time):
+        """`ttl` is the default time to live in seconds, `ttls` overrides
+        it by entity class name (a TTL of 0 disables caching the class).
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.ttls = dict(ttls or {})
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._stats = dict.fromkeys(('hits', 'stale_hits', 'misses',
+                                     'evictions', 'expirations'), 0)
+
+    def ttl_for(self, cls):
+        return self.ttls.get(cls._kind, self.ttl)
+
+    def get(self, cls, key, stale=False):
+        """Returns a copy of the cached data for the key, or None.
+
+        With `stale`, expired data is returned too (as a fallback).
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            # Re-insert as the most recently used; expired entries are kept
+            # around as fallbacks, until evicted
+            self._entries[key] = entry
+            expires, data = entry
+            if expires > self.clock():
+                self._stats['hits'] += 1
+            elif stale:
+                self._stats['stale_hits'] += 1
+            else:
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return None
+        return copy.deepcopy(data)
+
+    def set(self, cls, key, data):
+        ttl = self.ttl_for(cls)
+        if not ttl:
+            return
+        entry = (self.clock() + ttl, copy.deepcopy(data))
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, size=len(self._entries))
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = float(stats['hits']) / lookups if lookups else 0.0
+        return stats
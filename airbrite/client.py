@@ -1,17 +1,551 @@
+import threading
+import collections
+import contextlib
+import copy
+import os
+import random
+import sys
+import time
+import uuid
+import weakref
+import zlib
+import email.utils
+import math
+import concurrent.futures
 import requests
+import requests.adapters
 import json
 import api
+import codec as _codec
+import stream as _stream
 
 import logging
 logger = logging.getLogger('airbrite.client')
 
 
+###############################################################################
+
+class DeadlineExceeded(Exception):
+    """The time budget set with `deadline` ran out"""
+
+
+_deadline = threading.local()
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """Bound every Airbrite call made within the block to `seconds` from now.
+
+    Calls are aborted with DeadlineExceeded once the budget is spent. Nested
+    deadlines can only shorten the budget.
+    """
+    outer = getattr(_deadline, 'expires', None)
+    expires = time.time() + seconds
+    if outer is not None:
+        expires = min(expires, outer)
+    _deadline.expires = expires
+    try:
+        yield
+    finally:
+        _deadline.expires = outer
+
+
+def remaining():
+    """Seconds left before the current deadline, or None without one"""
+    expires = getattr(_deadline, 'expires', None)
+    if expires is None:
+        return None
+    return expires - time.time()
+
+
+def _under_deadline(expires, fn, *args, **kwargs):
+    """Run `fn` under the given absolute deadline (from another thread)"""
+    outer = getattr(_deadline, 'expires', None)
+    _deadline.expires = expires
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        _deadline.expires = outer
+
+
+def _check_deadline(what):
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded('deadline exceeded before %s' % what)
+    return left
+
+
+###############################################################################
+
+
+class RetryPolicy(object):
+    """When, and how long after, to retry a failed request"""
+
+    def __init__(self, max_attempts=3, statuses=(429, 500, 502, 503, 504),
+                 methods=('get', 'put'), backoff=0.5, max_backoff=30.0,
+                 deadline=None):
+        """Requests with one of `methods` (or carrying an idempotency key)
+        are attempted up to `max_attempts` times, when they fail to connect
+        or are answered with one of `statuses`.
+
+        Retries wait for the Retry-After the backend asks for or, lacking
+        one, for a random time up to `backoff` seconds doubled on each
+        attempt; either way for no more than `max_backoff` seconds. No
+        retry is made that would end past `deadline` seconds from the first
+        attempt.
+        """
+        self.max_attempts = max_attempts
+        self.statuses = statuses
+        self.methods = methods
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+
+    def should_retry(self, method, attempt, response=None, idempotent=False):
+        if attempt >= self.max_attempts:
+            return False
+        if method not in self.methods and not idempotent:
+            return False
+        return response is None or response.status_code in self.statuses
+
+    def delay(self, attempt, response=None):
+        """Seconds to wait before the next attempt"""
+        retry_after = self.retry_after(response)
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        cap = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return random.uniform(0, cap)
+
+    @staticmethod
+    def retry_after(response):
+        if response is None:
+            return None
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            parsed = email.utils.parsedate_tz(value)
+            if parsed is None:
+                return None
+            return max(email.utils.mktime_tz(parsed) - time.time(), 0.0)
+
+
+class CircuitOpen(Exception):
+    """Calls to an endpoint family are failing fast, its circuit is open"""
+
+
+def endpoint_family(url):
+    """The family of an Airbrite URL: `products`, `orders`,
+    `orders/*/shipments`, `customers`...
+    """
+    path = url[len(api.END_POINT):] if url.startswith(api.END_POINT) else url
+    parts = [part for part in path.split('/') if part]
+    if len(parts) >= 3:
+        return '%s/*/%s' % (parts[0], parts[2])
+    return parts[0] if parts else ''
+
+
+class CircuitBreaker(object):
+    """Per endpoint family circuit breakers.
+
+    A family's circuit opens after `failure_threshold` consecutive failures
+    (connection errors, 429 or 5xx answers), and calls to it fail fast with
+    CircuitOpen. After `reset_timeout` seconds a single trial call is let
+    through (half-open): if it succeeds the circuit closes, otherwise it
+    opens again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0,
+                 clock=time.time):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._circuits = {}
+
+    def _circuit(self, family):
+        return self._circuits.setdefault(
+            family, {'state': self.CLOSED, 'failures': 0, 'opened': None})
+
+    def state(self, family):
+        with self._lock:
+            return self._circuit(family)['state']
+
+    def before(self, family):
+        """Raise CircuitOpen unless a call to the family may go through"""
+        with self._lock:
+            circuit = self._circuit(family)
+            if circuit['state'] == self.CLOSED:
+                return
+            if circuit['state'] == self.OPEN and \
+                    self.clock() - circuit['opened'] >= self.reset_timeout:
+                circuit['state'] = self.HALF_OPEN
+                return
+        raise CircuitOpen('circuit for %s is open' % family)
+
+    def abort(self, family):
+        """A call let through ended without an answer to judge the family
+        by: if it was the trial, let another call try.
+        """
+        with self._lock:
+            circuit = self._circuit(family)
+            if circuit['state'] == self.HALF_OPEN:
+                circuit['state'] = self.OPEN
+
+    def success(self, family):
+        with self._lock:
+            circuit = self._circuit(family)
+            circuit.update(state=self.CLOSED, failures=0, opened=None)
+
+    def failure(self, family):
+        with self._lock:
+            circuit = self._circuit(family)
+            circuit['failures'] += 1
+            if circuit['state'] == self.HALF_OPEN or \
+                    circuit['failures'] >= self.failure_threshold:
+                if circuit['state'] != self.OPEN:
+                    logger.warning('opening the circuit for %s' % family)
+                circuit.update(state=self.OPEN, opened=self.clock())
+
+
+class HedgePolicy(object):
+    """When to send a duplicate of a slow GET"""
+
+    def __init__(self, percentile=95, min_delay=0.05, max_ratio=0.1,
+                 window=1000, min_samples=20):
+        """A GET still unanswered after the `percentile` latency of the
+        last `window` GETs (but no less than `min_delay` seconds) is sent
+        again, as long as hedges stay under `max_ratio` of the GETs sent.
+        Until `min_samples` latencies are known, `min_delay` is used.
+        """
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=window)
+        self._requests = 0
+        self._hedges = 0
+
+    def delay(self):
+        """Seconds to wait for an answer before hedging"""
+        with self._lock:
+            self._requests += 1
+            if len(self._latencies) < self.min_samples:
+                return self.min_delay
+            latencies = sorted(self._latencies)
+        # Nearest rank
+        index = int(math.ceil(len(latencies) * self.percentile / 100.0)) - 1
+        return max(self.min_delay,
+                   latencies[min(max(index, 0), len(latencies) - 1)])
+
+    def record(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def allow(self):
+        """Take a hedge from the budget, if any is left"""
+        with self._lock:
+            if self._hedges + 1 > self.max_ratio * self._requests:
+                return False
+            self._hedges += 1
+            return True
+
+
+def _spawn(fn, *args):
+    """Runs `fn` on a thread of its own, returns the future of its result"""
+    future = concurrent.futures.Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except BaseException:
+            future.set_exception_info(*sys.exc_info()[1:])
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return future
+
+
+def _completed(fn, *args, **kwargs):
+    """Runs `fn` now, returns a future holding its outcome"""
+    future = concurrent.futures.Future()
+    try:
+        future.set_result(fn(*args, **kwargs))
+    except Exception:
+        future.set_exception_info(*sys.exc_info()[1:])
+    return future
+
+
+def _close_answer(future):
+    """Closes the response of a hedged request that lost"""
+    if future.exception() is None:
+        _discard(future.result()[0])
+
+
+def compress(data, level=6):
+    """Returns the data gzipped"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress(content, encoding):
+    """Returns the content decoded from its gzip or deflate encoding"""
+    if encoding == 'gzip':
+        return zlib.decompress(content, 16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        try:
+            return zlib.decompress(content)
+        except zlib.error:
+            # Some servers send raw deflate data, without the zlib header
+            return zlib.decompress(content, -zlib.MAX_WBITS)
+    return content
+
+
+class Compression(object):
+    """Which request bodies to gzip"""
+
+    def __init__(self, min_size=1024, level=6):
+        """Bodies of at least `min_size` bytes are gzipped at `level`"""
+        self.min_size = min_size
+        self.level = level
+
+    def applies(self, data):
+        return len(data) >= self.min_size
+
+    def compress(self, data):
+        return compress(data, self.level)
+
+
+class IdempotencyJournal(object):
+    """In-memory record of the POSTs made under caller-supplied idempotency
+    keys. Records expire `ttl` seconds after they were last written.
+    """
+
+    def __init__(self, ttl=24 * 3600, clock=time.time):
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        # In the order written, hence of expiry
+        self._records = collections.OrderedDict()
+
+    def get(self, key):
+        """Returns the key's record: a dict with the `state` ('pending' or
+        'done') and, once done, the `response` data. None if unknown.
+        """
+        with self._lock:
+            self._expire()
+            return self._records.get(key)
+
+    def begin(self, key):
+        self._write(key, {'state': 'pending'})
+
+    def complete(self, key, response):
+        self._write(key, {'state': 'done', 'response': response})
+
+    def _write(self, key, record):
+        record['expires'] = self.clock() + self.ttl
+        with self._lock:
+            self._expire()
+            self._records.pop(key, None)
+            self._records[key] = record
+            self._append(key, record)
+
+    def _expire(self):
+        now = self.clock()
+        while self._records:
+            key, record = next(self._records.iteritems())
+            if record['expires'] > now:
+                break
+            del self._records[key]
+
+    def _append(self, key, record):
+        pass
+
+
+class FileIdempotencyJournal(IdempotencyJournal):
+    """Idempotency journal persisted to a file, surviving crashes.
+
+    Records are appended to the file, one JSON line each, and the file is
+    rewritten with only the live records once most of its lines are stale.
+    """
+
+    def __init__(self, path, ttl=24 * 3600, clock=time.time):
+        super(FileIdempotencyJournal, self).__init__(ttl, clock)
+        self.path = path
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        key, record = json.loads(line)
+                    except ValueError:
+                        # Cut short by a crash
+                        continue
+                    self._records.pop(key, None)
+                    self._records[key] = record
+            self._expire()
+        # Start from the live records, and a file ending with a full line
+        self._rewrite()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def _append(self, key, record):
+        if self._lines >= 2 * len(self._records) + 64:
+            self._rewrite()
+        self._file.write(json.dumps([key, record]) + '\n')
+        self._file.flush()
+        self._lines += 1
+
+    def _rewrite(self):
+        # Write aside and rename, so a crash never leaves a partial file
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for key, record in self._records.iteritems():
+                f.write(json.dumps([key, record]) + '\n')
+        os.rename(tmp_path, self.path)
+        if getattr(self, '_file', None) is not None:
+            self._file.close()
+        self._file = open(self.path, 'a')
+        self._lines = len(self._records)
+
+
+def _discard(response):
+    """Closes a response that won't be read, releasing its connection (a
+    streamed body otherwise holds it until collected)
+    """
+    if response is not None and hasattr(response, 'close'):
+        response.close()
+
+
+def _call_key(name, url, params, *extra):
+    """The key identical calls share, None if the params have no JSON form"""
+    try:
+        encoded = json.dumps(params, sort_keys=True)
+    except (TypeError, ValueError):
+        return None
+    return (name, url, encoded) + extra
+
+
+class _SessionOwner(object):
+    """Releases a thread's session when the thread exits"""
+
+    def __init__(self, client, session):
+        # Weak, as the client's thread locals hold this
+        self.client = weakref.ref(client)
+        self.session = session
+
+    def __del__(self):
+        client = self.client()
+        if client is not None:
+            client._release(self.session)
+
+
 class Client(object):
 
     headers = {
-        'Content-Type': 'application/json'
+        'Content-Type': 'application/json',
+        'Accept-Encoding': 'gzip, deflate',
     }
 
+    # Number of URLs whose validators `get_if_modified` remembers
+    max_validators = 10000
+
+    def __init__(self, pool_connections=10, pool_maxsize=10,
+                 pool_block=False, thread_local=False, max_workers=10,
+                 single_flight=True, retry=None, journal=None,
+                 rate_limiter=None, concurrency=None, timeout=(3.05, 30),
+                 hedge=None, breaker=None, transport=None, codec=None,
+                 compression=None):
+        """Keep-alive HTTP client for the Airbrite API.
+
+        Connections are pooled by a `requests.Session`, shared by every
+        thread unless `thread_local` is set, in which case each thread gets
+        its own session (and pool). `pool_connections` is the number of
+        hosts to keep pools for, and `pool_maxsize` the number of
+        connections kept open per host.
+
+        Calls submitted with `submit` run on a pool of up to `max_workers`
+        threads, all sharing the connection pool.
+
+        With `single_flight`, concurrent identical GETs share a single HTTP
+        call, whose result every caller receives.
+
+        Failed requests are retried as `retry` (a RetryPolicy) allows; by
+        default, idempotent GETs and PUTs are retried on connection errors
+        and 429/5xx responses. Pass `RetryPolicy(max_attempts=1)` to never
+        retry.
+
+        Every POST carries an Idempotency-Key header, so it is safe to retry.
+        When a `journal` (an IdempotencyJournal) is given, POSTs completed
+        under a caller-supplied key are not sent again, but answered from
+        the journal.
+
+        A `rate_limiter` (a ratelimit.RateLimiter) delays requests, retries
+        included, to keep under the rate it allows, and a `concurrency`
+        limiter (a ratelimit.AdaptiveConcurrency) caps the requests in
+        flight.
+
+        `timeout` is the (connect, read) timeout of every request, in
+        seconds; within a `deadline` block it is shortened to the time left.
+
+        With a `hedge` policy (a HedgePolicy), slow GETs are duplicated and
+        the first answer is taken.
+
+        With a `breaker` (a CircuitBreaker), calls to a failing endpoint
+        family fail fast with CircuitOpen.
+
+        Requests are sent over the pooled session, unless a `transport` (a
+        transport.Transport) is given to carry them instead.
+
+        Request and response bodies are encoded and decoded by `codec` (see
+        the codec module), by default the fastest JSON library installed.
+
+        Compressed responses (gzip or deflate) are accepted and decoded.
+        With `compression` (a Compression), large request bodies are sent
+        gzipped too. The `request_bytes` and `response_bytes` counters hold
+        the body sizes before compression, `request_bytes_sent` and
+        `response_bytes_received` after it.
+        """
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.thread_local = thread_local
+        self.max_workers = max_workers
+        self.single_flight = single_flight
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.journal = journal
+        self.rate_limiter = rate_limiter
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.hedge = hedge
+        self.breaker = breaker
+        self.transport = transport
+        self.codec = codec if codec is not None else _codec.default()
+        self.compression = compression
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # Marks the threads running submitted calls
+        self._worker = threading.local()
+        self._session = None
+        self._sessions = set()
+        self._executor = None
+        self._hedge_executor = None
+        self._validators = collections.OrderedDict()
+        self._inflight = {}
+        self._counters = collections.Counter()
+
     @property
     def api_key(self):
         return api.KEY
@@ -24,22 +558,527 @@ class Client(object):
     def auth(self):
         return (api.KEY, api.KEY_PASSWORD)
 
+    ###########################################################################
+    # Connection pooling
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        with self._lock:
+            self._sessions.add(session)
+        return session
+
+    def _release(self, session):
+        """Close a session the client no longer hands out"""
+        with self._lock:
+            if session not in self._sessions:
+                # Closed with the client already
+                return
+            self._sessions.discard(session)
+        session.close()
+
+    @property
+    def session(self):
+        """The `requests.Session` to use from the calling thread"""
+        if self.thread_local:
+            session = getattr(self._local, 'session', None)
+            if session is None:
+                session = self._local.session = self._new_session()
+                # Dropped with the thread's locals, closing the session
+                self._local.owner = _SessionOwner(self, session)
+            return session
+
+        if self._session is None:
+            session = self._new_session()
+            with self._lock:
+                if self._session is None:
+                    self._session = session
+        return self._session
+
+    def close(self):
+        """Close every pooled connection and worker opened by this client"""
+        with self._lock:
+            sessions, self._sessions = self._sessions, set()
+            executors = [self._executor, self._hedge_executor]
+            self._executor = self._hedge_executor = None
+            self._session = None
+            # Dropped once unlocked, as it may release sessions
+            local, self._local = self._local, threading.local()
+        del local
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown(wait=False)
+        for session in sessions:
+            session.close()
+        if self.transport is not None:
+            self.transport.close()
+
+    def pool_stats(self):
+        """Returns connection reuse counters for the live pools.
+
+        `requests` is the number of HTTP requests sent, `connections` the
+        number of connections opened to serve them.
+        """
+        with self._lock:
+            sessions = list(self._sessions)
+
+        n_requests, n_connections = 0, 0
+        for session in sessions:
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool is None:
+                        continue
+                    n_requests += pool.num_requests
+                    n_connections += pool.num_connections
+
+        reused = max(n_requests - n_connections, 0)
+        return {
+            'sessions': len(sessions),
+            'requests': n_requests,
+            'connections': n_connections,
+            'reused': reused,
+            'reuse_rate': float(reused) / n_requests if n_requests else 0.0,
+        }
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def stats(self):
+        """Returns the client counters, along with the pool ones"""
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update(('pool_' + k, v) for k, v in self.pool_stats().items())
+        if self.concurrency is not None:
+            stats['concurrency_window'] = self.concurrency.window
+            stats['in_flight'] = self.concurrency.in_flight
+        return stats
+
+    ###########################################################################
+    # Concurrent calls
+
+    @property
+    def executor(self):
+        """The `concurrent.futures` thread pool running submitted calls"""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=self.max_workers)
+        return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedule `fn(*args, **kwargs)` and return its Future.
+
+        Calls still waiting for a worker can be dropped with
+        `future.cancel()`. The caller's deadline, if any, applies to the
+        call too. Submitted from one of the workers, the call runs right
+        away instead, as waiting on the workers from there may deadlock.
+        """
+        if getattr(self._worker, 'busy', False):
+            return _completed(fn, *args, **kwargs)
+        expires = getattr(_deadline, 'expires', None)
+        return self.executor.submit(self._work, expires, fn, *args, **kwargs)
+
+    def _work(self, expires, fn, *args, **kwargs):
+        """Run a submitted call, on a worker"""
+        self._worker.busy = True
+        try:
+            return _under_deadline(expires, fn, *args, **kwargs)
+        finally:
+            self._worker.busy = False
+
+    def _coalesce(self, key, fn, *args, **kwargs):
+        """Run `fn`, unless an identical call is in flight; then wait for
+        it and return (a copy of) its result instead. Calls without a `key`
+        always run.
+        """
+        if not self.single_flight or key is None:
+            return fn(*args, **kwargs)
+
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = concurrent.futures.Future()
+
+        if not leader:
+            self.count('collapsed')
+            try:
+                result = call.result(timeout=_check_deadline(fn.__name__))
+            except concurrent.futures.TimeoutError:
+                raise DeadlineExceeded('deadline exceeded waiting for %s'
+                                       % fn.__name__)
+            # Callers are free to modify the data they get, so copy it
+            return copy.deepcopy(result)
+
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    ###########################################################################
+    # HTTP methods
+
+    def request(self, method, url, **params):
+        """Send a request over the pooled session and return the response.
+
+        Retries as the retry policy allows, within the current deadline.
+        """
+        params.setdefault('auth', self.auth)
+        params.setdefault('headers', self.headers)
+        timeout = params.pop('timeout', self.timeout)
+
+        policy = self.retry
+        idempotent = 'Idempotency-Key' in params['headers']
+        # A streamed body is read after the race, so there is none to win
+        hedged = method == 'get' and self.hedge is not None and \
+            not params.get('stream')
+        send = self._send_hedged if hedged else self._send
+        family = endpoint_family(url)
+        started = time.time()
+        attempt = 0
+        while True:
+            attempt += 1
+            self.check_circuit(family)
+            try:
+                self.throttle(method)
+                left = _check_deadline('%s() on %s' % (method, url))
+                if left is not None:
+                    self.count('deadline_bounded')
+                response = send(method, url,
+                                timeout=self._timeout(timeout, left),
+                                **params)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response, error = None, e
+                self.track_circuit(family, response)
+                if not policy.should_retry(method, attempt,
+                                           idempotent=idempotent):
+                    raise
+            except requests.RequestException:
+                self.track_circuit(family, None)
+                raise
+            except BaseException:
+                # Never sent, or abandoned: no verdict on the family
+                self.abort_circuit(family)
+                raise
+            else:
+                self.track_circuit(family, response)
+                if not policy.should_retry(method, attempt, response,
+                                           idempotent=idempotent):
+                    return response
+                error = 'status code %s' % response.status_code
+
+            delay = policy.delay(attempt, response)
+            left = remaining()
+            if left is not None and delay >= left:
+                self.count('deadline_exceeded')
+                _discard(response)
+                raise DeadlineExceeded('deadline exceeded retrying %s() on %s'
+                                       ' after %s' % (method, url, error))
+            if policy.deadline is not None and \
+                    time.time() + delay - started > policy.deadline:
+                logger.warning('%s() on %s out of retry budget after %s'
+                               % (method, url, error))
+                if response is None:
+                    raise error
+                return response
+
+            logger.info('%s() on %s failed with %s, retrying in %.2fs'
+                        % (method, url, error, delay))
+            self.count('retries')
+            self.count('retry_wait', delay)
+            _discard(response)
+            self.sleep(delay)
+
+    @staticmethod
+    def _timeout(timeout, left):
+        """Shorten the (connect, read) timeout to the time left, if any"""
+        if left is None or timeout is None:
+            return timeout if timeout is not None else left
+        if isinstance(timeout, tuple):
+            return tuple(min(t, left) for t in timeout)
+        return min(timeout, left)
+
+    def _dispatch(self, method, url, **params):
+        if self.transport is not None:
+            response = self.transport.send(method, url, **params)
+            # `requests` decodes the content already, transports do not
+            encoding = response.headers.get('Content-Encoding')
+            if encoding in ('gzip', 'deflate'):
+                response.content = decompress(response.content, encoding)
+            return response
+        return getattr(self.session, method)(url, **params)
+
+    def _send(self, method, url, **params):
+        limiter = self.concurrency
+        if limiter is None:
+            return self._dispatch(method, url, **params)
+
+        if not limiter.acquire(remaining()):
+            raise DeadlineExceeded('deadline exceeded waiting to send')
+        started, ok = time.time(), False
+        try:
+            response = self._dispatch(method, url, **params)
+            ok = response.status_code != 429 and response.status_code < 500
+            return response
+        finally:
+            limiter.release(time.time() - started, ok)
+
+    def _send_hedged(self, method, url, **params):
+        """Send the request; if it is slow to answer, send it again and
+        return the first good answer, closing the other.
+
+        The request runs on a thread of its own, so it never queues behind
+        other callers on the workers, which only send the hedges.
+        """
+        if self._hedge_executor is None:
+            with self._lock:
+                if self._hedge_executor is None:
+                    self._hedge_executor = \
+                        concurrent.futures.ThreadPoolExecutor(
+                            max_workers=2 * self.max_workers)
+
+        expires = getattr(_deadline, 'expires', None)
+
+        def timed_send():
+            started = time.time()
+            response = _under_deadline(expires, self._send, method, url,
+                                       **params)
+            return response, time.time() - started
+
+        def left():
+            if expires is None:
+                return None
+            return max(expires - time.time(), 0)
+
+        delay = self.hedge.delay()
+        primary = _spawn(timed_send)
+        pending = [primary]
+        budget = left()
+        concurrent.futures.wait(
+            pending, timeout=delay if budget is None else min(delay, budget))
+        if not primary.done() and self.hedge.allow():
+            self.count('hedges')
+            pending.append(self._hedge_executor.submit(timed_send))
+
+        winner = failed = None
+        while pending and winner is None:
+            done, _ = concurrent.futures.wait(
+                pending, timeout=left(),
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                for future in pending:
+                    future.add_done_callback(_close_answer)
+                raise DeadlineExceeded('deadline exceeded waiting for %s'
+                                       % url)
+            for future in done:
+                pending.remove(future)
+                if future.exception() is not None:
+                    failed = failed or future
+                elif winner is None:
+                    winner = future
+                else:
+                    _close_answer(future)
+        # Release the answer that lost once it comes
+        for future in pending:
+            future.add_done_callback(_close_answer)
+        if winner is None:
+            # Both failed, raise the first failure
+            return failed.result()
+        if winner is not primary:
+            self.count('hedge_wins')
+        response, latency = winner.result()
+        self.hedge.record(latency)
+        return response
+
+    def check_circuit(self, family):
+        if self.breaker is None:
+            return
+        try:
+            self.breaker.before(family)
+        except CircuitOpen:
+            self.count('circuit_open')
+            raise
+
+    def abort_circuit(self, family):
+        if self.breaker is not None:
+            self.breaker.abort(family)
+
+    def track_circuit(self, family, response):
+        """Account for an answer (None for a connection failure)"""
+        if self.breaker is None:
+            return
+        if response is None or response.status_code == 429 or \
+                response.status_code >= 500:
+            self.breaker.failure(family)
+        else:
+            self.breaker.success(family)
+
+    def throttle(self, method):
+        """Wait for the rate limiter to allow a request"""
+        if self.rate_limiter is None:
+            return
+        wait = self.rate_limiter.reserve(method, self.api_key)
+        left = remaining()
+        if left is not None and wait >= left:
+            self.count('deadline_exceeded')
+            raise DeadlineExceeded('deadline exceeded waiting for the rate'
+                                   ' limiter')
+        if wait > 0:
+            self.count('throttled')
+            self.count('throttle_wait', wait)
+            self.sleep(wait)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def _fail(self, method, req, params):
+        logger.warning('%s() call failed with status code %s, response: %s'
+                       % (method, req.status_code, req.content))
+        raise Exception('Bad get parameters: %s' % params)
+
     def meth(self, method, url, expected=200, **params):
         logger.debug('calling %s on %s with %s' % (method, url, params))
-        req = getattr(requests, method)(url, auth=self.auth,
-                                        headers=self.headers,
-                                        **params)
+        req = self.request(method, url, **params)
         if req.status_code != expected:
-            logger.warning('%s() call failed with status code %s, response: %s'
-                           % (method, req.status_code, req.json()))
-            raise Exception('Bad get parameters: %s' % params)
-        return req.json()
+            self._fail(method, req, params)
+        return self._decode(req)
+
+    def _encode(self, params, headers):
+        """Returns the body for the params, gzipped if large enough, and
+        the headers to send it with.
+        """
+        data = self.codec.dumps(params)
+        self.count('request_bytes', len(data))
+        if self.compression is not None and self.compression.applies(data):
+            data = self.compression.compress(data)
+            headers = dict(headers, **{'Content-Encoding': 'gzip'})
+        self.count('request_bytes_sent', len(data))
+        return data, headers
+
+    def _decode(self, req):
+        content = req.content
+        self.count('response_bytes', len(content))
+        # Content-Length is the size of the body as sent, encoded
+        received = len(content)
+        if req.headers.get('Content-Encoding') in ('gzip', 'deflate'):
+            received = int(req.headers.get('Content-Length', received))
+        self.count('response_bytes_received', received)
+        return self.codec.decode(req)
 
     def get(self, url, **params):
-        return self.meth('get', url, params=params)
+        return self._coalesce(_call_key('get', url, params),
+                              self.meth, 'get', url, params=params)
+
+    def stream(self, url, item=None, chunk_size=64 * 1024, **params):
+        """GET a list, returns a stream.ListStream of its `data` elements
+        (passed through `item`), parsed as the response body arrives.
+        """
+        logger.debug('calling get on %s with %s (streamed)' % (url, params))
+        req = self.request('get', url, params=params, stream=True)
+        if req.status_code != 200:
+            self._fail('get', req, params)
+        self.count('streamed')
+        return _stream.ListStream(req.iter_content(chunk_size), item=item,
+                                  close=getattr(req, 'close', None))
+
+    def get_if_modified(self, url, updated=None, **params):
+        """GET the URL, unless unchanged since the last response seen.
+
+        `updated` is the `updated` timestamp of the caller's copy. When it
+        matches the response the client last saw for the URL, that
+        response's ETag and Last-Modified validators are sent; otherwise
+        the timestamp itself is sent as If-Modified-Since. Returns None if
+        the backend answers 304 Not Modified.
+        """
+        return self._coalesce(_call_key('get_if_modified', url, params,
+                                        updated),
+                              self._get_if_modified, url, updated, **params)
+
+    def _get_if_modified(self, url, updated=None, **params):
+        headers = dict(self.headers)
+        if updated is not None:
+            with self._lock:
+                validators = self._validators.pop(url, {})
+                if validators:
+                    # Most recently used last
+                    self._validators[url] = validators
+            if validators.get('updated') == updated:
+                if validators.get('etag'):
+                    headers['If-None-Match'] = validators['etag']
+                if validators.get('last_modified'):
+                    headers['If-Modified-Since'] = validators['last_modified']
+            if 'If-Modified-Since' not in headers:
+                headers['If-Modified-Since'] = email.utils.formatdate(
+                    updated, usegmt=True)
+
+        logger.debug('calling get on %s with %s (conditional)' % (url, params))
+        req = self.request('get', url, params=params, headers=headers)
+        if req.status_code == 304:
+            self.count('not_modified')
+            return None
+        if req.status_code != 200:
+            self._fail('get', req, params)
+
+        data = self._decode(req)
+        etag = req.headers.get('ETag')
+        last_modified = req.headers.get('Last-Modified')
+        if etag or last_modified:
+            body = data.get('data')
+            validators = {
+                'etag': etag,
+                'last_modified': last_modified,
+                'updated': body.get('updated') if isinstance(body, dict)
+                else None,
+            }
+            with self._lock:
+                self._validators.pop(url, None)
+                self._validators[url] = validators
+                while len(self._validators) > self.max_validators:
+                    self._validators.popitem(last=False)
+        self.count('modified')
+        return data
+
+    def post(self, url, idempotency_key=None, **params):
+        """POST the params, under the given idempotency key (or a new one).
+
+        Pass the same key when repeating a logical operation, e.g. after a
+        crash, so the backend (and the journal) can deduplicate it.
+        """
+        key = idempotency_key or str(uuid.uuid4())
+        # Only a caller's key can be repeated, so only those are journaled
+        journaled = self.journal is not None and idempotency_key is not None
+        if journaled:
+            record = self.journal.get(key)
+            if record is not None and record['state'] == 'done':
+                self.count('deduplicated')
+                return record['response']
+            self.journal.begin(key)
 
-    def post(self, url, **params):
-        return self.meth('post', url, expected=201, data=json.dumps(params))
+        headers = dict(self.headers)
+        headers['Idempotency-Key'] = key
+        body, headers = self._encode(params, headers)
+        data = self.meth('post', url, expected=201, headers=headers,
+                         data=body)
+        if journaled:
+            self.journal.complete(key, data)
+        return data
 
     def put(self, url, **params):
-        return self.meth('put', url, data=json.dumps(params))
+        body, headers = self._encode(params, self.headers)
+        return self.meth('put', url, headers=headers, data=body)
@@ -0,0 +1,67 @@
+"""JSON codecs, to encode request bodies and decode response bodies.
+
+Decoding straight from the response bytes skips the charset detection and
+unicode decoding `requests` does in `Response.json()`. The fastest library
+installed is used by default (ujson, then simplejson, then the standard
+library json), and any client can be given another one:
+
+    client = Client(codec=codec.JSONCodec())     # always the stdlib json
+"""
+import json
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+
+
+class JSONCodec (object):
+    """Encodes and decodes with the standard library `json` module"""
+
+    name = 'json'
+
+    def dumps(self, obj):
+        return json.dumps(obj)
+
+    def loads(self, content):
+        return json.loads(content)
+
+    def decode(self, response):
+        """Decodes the body of a response, from its raw bytes"""
+        return self.loads(response.content)
+
+
+class SimpleJSONCodec (JSONCodec):
+
+    name = 'simplejson'
+
+    def dumps(self, obj):
+        return simplejson.dumps(obj)
+
+    def loads(self, content):
+        return simplejson.loads(content)
+
+
+class UJSONCodec (JSONCodec):
+
+    name = 'ujson'
+
+    def dumps(self, obj):
+        return ujson.dumps(obj)
+
+    def loads(self, content):
+        return ujson.loads(content)
+
+
+def default():
+    """Returns a codec for the fastest JSON library installed"""
+    if ujson is not None:
+        return UJSONCodec()
+    if simplejson is not None:
+        return SimpleJSONCodec()
+    return JSONCodec()
@@ -0,0 +1,149 @@
+"""Local SQLite replica of Airbrite entities.
+
+Entities are stored as their raw `_data`, next to indexed copies of the
+fields most queries use, so lookups never touch the network:
+
+    mirror = Mirror('airbrite.db')
+    mirror.load(Product)
+    mirror.find(Product, sku='first-product')
+    mirror.find(Order, customer_id=customer._id, order_by='created')
+
+A `Mirror` implements the store interface of `airbrite.sync`, so it can be
+kept current with a `sync.Syncer`.
+"""
+import json
+import sqlite3
+import threading
+
+import logging
+logger = logging.getLogger('airbrite.mirror')
+
+
+class Mirror (object):
+
+    # Fields copied out of `_data` into indexed columns
+    INDEXED = ('sku', 'customer_id', 'order_id', 'created', 'updated')
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS entities ('
+                ' kind TEXT NOT NULL,'
+                ' _id TEXT NOT NULL,'
+                ' sku TEXT,'
+                ' customer_id TEXT,'
+                ' order_id TEXT,'
+                ' created INTEGER,'
+                ' updated INTEGER,'
+                ' data TEXT NOT NULL,'
+                ' PRIMARY KEY (kind, _id))')
+            for field in self.INDEXED:
+                self._db.execute(
+                    'CREATE INDEX IF NOT EXISTS entities_%s'
+                    ' ON entities (kind, %s)' % (field, field))
+
+    def close(self):
+        self._db.close()
+
+    ###########################################################################
+    # Writes
+
+    def _row(self, entity):
+        data = entity.to_dict()
+        return ((entity._kind, entity._id) +
+                tuple(data.get(field) for field in self.INDEXED) +
+                (json.dumps(data),))
+
+    def add(self, entities):
+        """Stores (or replaces) the given entities"""
+        rows = [self._row(entity) for entity in entities]
+        with self._lock, self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?, ?, ?, ?,'
+                ' ?)', rows)
+        return len(rows)
+
+    def merge(self, entity):
+        """Stores the entity, returns 'created', 'updated' or None"""
+        row = self._row(entity)
+        with self._lock, self._db:
+            current = self._db.execute(
+                'SELECT data FROM entities WHERE kind = ? AND _id = ?',
+                row[:2]).fetchone()
+            if current is not None and json.loads(current[0]) == \
+                    entity.to_dict():
+                return None
+            self._db.execute(
+                'INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?, ?, ?, ?,'
+                ' ?)', row)
+        return 'updated' if current is not None else 'created'
+
+    def remove(self, cls, _id):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM entities WHERE kind = ? AND _id = ?',
+                             (cls._kind, _id))
+
+    def load(self, cls, **filters):
+        """Replicates every entity of the class, returns how many"""
+        count, batch = 0, []
+        for entity in cls.iter_all(**filters):
+            batch.append(entity)
+            if len(batch) == 500:
+                count += self.add(batch)
+                batch = []
+        return count + self.add(batch)
+
+    ###########################################################################
+    # Queries
+
+    def get(self, cls, _id):
+        """Returns the entity with that _id, or None"""
+        found = self.find(cls, _id=_id)
+        return found[0] if found else None
+
+    def all(self, cls):
+        return self.find(cls)
+
+    def find(self, cls, order_by=None, limit=None, since=None, until=None,
+             **where):
+        """Returns the entities matching every `field=value` given.
+
+        Matches on `_id` or any of the indexed fields; `since` and `until`
+        bound the `updated` timestamp, and results can be sorted by an
+        indexed field (prefix with `-` for descending order).
+        """
+        clauses, args = ['kind = ?'], [cls._kind]
+        for field, value in where.items():
+            if field != '_id' and field not in self.INDEXED:
+                raise ValueError('cannot query on %s' % field)
+            clauses.append('%s = ?' % field)
+            args.append(value)
+        if since is not None:
+            clauses.append('updated >= ?')
+            args.append(since)
+        if until is not None:
+            clauses.append('updated <= ?')
+            args.append(until)
+
+        query = 'SELECT data FROM entities WHERE ' + ' AND '.join(clauses)
+        if order_by:
+            field = order_by.lstrip('-')
+            if field != '_id' and field not in self.INDEXED:
+                raise ValueError('cannot order by %s' % field)
+            query += ' ORDER BY %s %s' % (
+                field, 'DESC' if order_by.startswith('-') else 'ASC')
+        if limit is not None:
+            query += ' LIMIT %d' % int(limit)
+
+        with self._lock:
+            rows = self._db.execute(query, args).fetchall()
+        return [cls(**json.loads(data)) for (data,) in rows]
+
+    def count(self, cls):
+        with self._lock:
+            return self._db.execute(
+                'SELECT COUNT(*) FROM entities WHERE kind = ?',
+                (cls._kind,)).fetchone()[0]
@@ -0,0 +1,155 @@
+"""Client-side flow control: token-bucket rate limiting, and adaptive
+concurrency limiting.
+
+A `RateLimiter` keeps one bucket per API key and HTTP method. Buckets live
+in a backend: `MemoryBackend` shares them between the threads of a process,
+`FileBackend` between every process using the same state file:
+
+    limiter = RateLimiter(rate=20, burst=40, per_method={'post': (5, 5)},
+                          backend=FileBackend('/tmp/airbrite-rate.json'))
+    client = Client(rate_limiter=limiter)
+
+An `AdaptiveConcurrency` limiter caps the requests in flight to a window
+that grows while they succeed quickly, and is cut back on throttling,
+server errors or latency spikes (AIMD):
+
+    client = Client(concurrency=AdaptiveConcurrency(maximum=32))
+"""
+import os
+import json
+import time
+import fcntl
+import threading
+
+
+def _take(bucket, rate, burst, now):
+    """Debit a token from the (tokens, stamp) bucket, refilled at `rate`
+    tokens per second up to `burst`.
+
+    Returns the new bucket and the seconds to wait for the token; the token
+    is reserved either way, so waiters are served in order.
+    """
+    tokens, stamp = bucket if bucket else (burst, now)
+    tokens = min(burst, tokens + (now - stamp) * rate) - 1
+    wait = -tokens / rate if tokens < 0 else 0.0
+    return (tokens, now), wait
+
+
+class MemoryBackend (object):
+    """Buckets shared by the threads of this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def take(self, name, rate, burst, now):
+        with self._lock:
+            self._buckets[name], wait = _take(self._buckets.get(name),
+                                              rate, burst, now)
+        return wait
+
+
+class FileBackend (object):
+    """Buckets shared by every process using the same (POSIX) state file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def take(self, name, rate, burst, now):
+        with self._lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                with os.fdopen(os.dup(fd), 'r+') as f:
+                    content = f.read()
+                    buckets = json.loads(content) if content else {}
+                    buckets[name], wait = _take(buckets.get(name),
+                                                rate, burst, now)
+                    f.seek(0)
+                    f.truncate()
+                    json.dump(buckets, f)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+        return wait
+
+
+class RateLimiter (object):
+
+    def __init__(self, rate=10.0, burst=None, per_method=None, backend=None,
+                 clock=time.time):
+        """Allow `rate` requests per second, in bursts of up to `burst`
+        (`rate` by default), for each API key and HTTP method.
+
+        `per_method` overrides the (rate, burst) of specific methods.
+        """
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.per_method = dict(per_method or {})
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.clock = clock
+
+    def reserve(self, method, key=''):
+        """Take a token, returns the seconds to wait before using it"""
+        rate, burst = self.per_method.get(method, (self.rate, self.burst))
+        return self.backend.take('%s:%s' % (key, method), float(rate),
+                                 float(burst), self.clock())
+
+
+class AdaptiveConcurrency (object):
+
+    def __init__(self, initial=4, minimum=1, maximum=64, latency_target=1.0,
+                 decrease=0.5, clock=time.time):
+        """Start with a window of `initial` requests in flight, kept
+        between `minimum` and `maximum`.
+
+        Each request answered within `latency_target` seconds grows the
+        window by about one request per window's worth of answers; a
+        failed, throttled or slow one multiplies it by `decrease`, at most
+        once per `latency_target`.
+        """
+        self.window = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.decrease = decrease
+        self.clock = clock
+
+        self.in_flight = 0
+        self._decreased = None
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """Block until the window admits one more request, or for at most
+        `timeout` seconds; returns whether it did.
+        """
+        with self._cond:
+            if timeout is not None:
+                expires = time.time() + timeout
+            while self.in_flight >= int(self.window):
+                if timeout is None:
+                    self._cond.wait()
+                    continue
+                left = expires - time.time()
+                if left <= 0:
+                    return False
+                self._cond.wait(left)
+            self.in_flight += 1
+            return True
+
+    def release(self, latency, ok=True):
+        """Account for a finished request"""
+        with self._cond:
+            self.in_flight -= 1
+            if ok and latency <= self.latency_target:
+                self.window = min(self.maximum,
+                                  self.window + 1.0 / self.window)
+            else:
+                now = self.clock()
+                if self._decreased is None or \
+                        now - self._decreased >= self.latency_target:
+                    self._decreased = now
+                    self.window = max(float(self.minimum),
+                                      self.window * self.decrease)
+            self._cond.notify_all()
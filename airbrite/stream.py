@@ -0,0 +1,136 @@
+"""Incremental parsing of list responses.
+
+A `ListStream` parses a `{"data": [...], "paging": {...}, "meta": {...}}`
+body as its chunks arrive, and yields the elements of `data` one at a time,
+so a large page is never held in memory both as JSON text and as a list of
+entities:
+
+    orders = Order.stream(limit=1000)
+    for order in orders:
+        ...
+    orders.paging
+"""
+import json
+
+_WHITESPACE = ' \t\n\r'
+
+
+class ListStream (object):
+
+    def __init__(self, chunks, item=None, close=None):
+        """Parse the body given as an iterable of `chunks` of bytes.
+
+        Each element of `data` is passed through `item` (e.g. an entity
+        class) before being yielded, and `close` is called once the body
+        was parsed, or the stream abandoned.
+        """
+        self.paging = None
+        self.meta = None
+        self._chunks = iter(chunks)
+        self._item = item
+        self._close = close
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self._started = False
+        self._items = self._parse()
+
+    def __iter__(self):
+        return self._items
+
+    def next(self):
+        return next(self._items)
+
+    def close(self):
+        """Stop parsing, releasing the response"""
+        self._items.close()
+        if not self._started:
+            # The parser never ran, so it can't release it
+            self._started = True
+            if self._close is not None:
+                self._close()
+
+    ###########################################################################
+
+    def _fill(self):
+        """Reads the next chunk, returns False at the end of the body"""
+        if self._eof:
+            return False
+        for chunk in self._chunks:
+            if chunk:
+                # Drop what was parsed already
+                self._buffer = self._buffer[self._pos:] + chunk
+                self._pos = 0
+                return True
+        self._eof = True
+        return False
+
+    def _peek(self):
+        """Returns the next non-whitespace character, without consuming it"""
+        while True:
+            while self._pos < len(self._buffer) and \
+                    self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError('truncated list response')
+
+    def _expect(self, char):
+        found = self._peek()
+        if found != char:
+            raise ValueError('expected %r in list response, found %r'
+                             % (char, found))
+        self._pos += 1
+
+    def _value(self):
+        """Decodes the next complete JSON value"""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                # Incomplete, unless the body is over
+                if not self._fill():
+                    raise
+                continue
+            # A number at the end of the buffer may go on in the next chunk
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _parse(self):
+        self._started = True
+        try:
+            self._expect('{')
+            if self._peek() == '}':
+                return
+            while True:
+                key = self._value()
+                self._expect(':')
+                if key == 'data' and self._peek() == '[':
+                    self._pos += 1
+                    if self._peek() == ']':
+                        self._pos += 1
+                    else:
+                        while True:
+                            data = self._value()
+                            yield self._item(data) if self._item else data
+                            if self._peek() != ',':
+                                break
+                            self._pos += 1
+                        self._expect(']')
+                elif key in ('paging', 'meta'):
+                    setattr(self, key, self._value())
+                else:
+                    self._value()
+                if self._peek() != ',':
+                    break
+                self._pos += 1
+            self._expect('}')
+        finally:
+            self._buffer = ''
+            if self._close is not None:
+                self._close()
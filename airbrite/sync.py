@@ -0,0 +1,173 @@
+"""Keep a local view of Airbrite entities current, incrementally.
+
+A `Syncer` pulls only the entities updated since its last checkpoint (the
+highest `updated` timestamp it has seen), merges them into a local store and
+reports what changed:
+
+    checkpoints = sync.FileCheckpoints('/var/lib/shop/airbrite.json')
+    store = sync.MemoryStore()
+    delta = sync.Syncer(Order, checkpoints, store).sync()
+    delta['created'], delta['updated']
+"""
+import os
+import json
+import threading
+
+import api
+
+import logging
+logger = logging.getLogger('airbrite.sync')
+
+
+###############################################################################
+
+class Checkpoints (object):
+    """In-memory high-water marks, keyed by entity class"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._marks = {}
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._marks.get(key, default)
+
+    def set(self, key, mark):
+        with self._lock:
+            self._marks[key] = mark
+            self._save()
+
+    def _save(self):
+        pass
+
+
+class FileCheckpoints (Checkpoints):
+    """High-water marks persisted to a JSON file"""
+
+    def __init__(self, path):
+        super(FileCheckpoints, self).__init__()
+        self.path = path
+        if os.path.exists(path):
+            with open(path) as f:
+                self._marks = json.load(f)
+
+    def _save(self):
+        # Write aside and rename, so a crash never leaves a partial file
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._marks, f)
+        os.rename(tmp_path, self.path)
+
+
+###############################################################################
+
+class MemoryStore (object):
+    """Local store of entity data, keyed by entity class and _id"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def get(self, cls, _id):
+        data = self._data.get((cls._kind, _id))
+        if data is None:
+            return None
+        return cls(**data)
+
+    def all(self, cls):
+        return [cls(**data) for (name, _), data in self._data.items()
+                if name == cls._kind]
+
+    def merge(self, entity):
+        """Stores the entity, returns 'created', 'updated' or None"""
+        key = (entity._kind, entity._id)
+        data = entity.to_dict()
+        with self._lock:
+            current = self._data.get(key)
+            if current == data:
+                return None
+            self._data[key] = data
+        return 'updated' if current is not None else 'created'
+
+
+###############################################################################
+
+class Syncer (object):
+    """Pull the entities of a class updated since the last sync"""
+
+    def __init__(self, entity, checkpoints, store, page_size=None,
+                 **filters):
+        """`filters` are passed to `entity.list`, e.g. the `order_id` for
+        shipments. Pages of `page_size` entities (the entity's PAGE_SIZE
+        by default) are requested.
+        """
+        self.entity = entity
+        self.checkpoints = checkpoints
+        self.store = store
+        self.page_size = page_size or entity.PAGE_SIZE
+        self.filters = filters
+
+    @property
+    def key(self):
+        if 'order_id' in self.filters:
+            return '%s:%s' % (self.entity._kind, self.filters['order_id'])
+        return self.entity._kind
+
+    def sync(self):
+        """Merges the changes into the store and returns the delta.
+
+        The delta is a dict with the `created` and `updated` _ids, and the
+        new `checkpoint`. The checkpoint only moves once every page was
+        merged, so an interrupted sync is simply resumed by the next one.
+        """
+        mark = self.checkpoints.get(self.key)
+        delta = {'created': [], 'updated': [], 'checkpoint': mark}
+        for entity in self._changed_since(mark):
+            change = self.store.merge(entity)
+            if change:
+                delta[change].append(entity._id)
+            updated = entity.to_dict().get('updated')
+            if updated is not None and (delta['checkpoint'] is None or
+                                        updated > delta['checkpoint']):
+                delta['checkpoint'] = updated
+
+        if delta['checkpoint'] != mark:
+            self.checkpoints.set(self.key, delta['checkpoint'])
+        logger.debug('sync(%s) created %d, updated %d, checkpoint %s'
+                     % (self.key, len(delta['created']),
+                        len(delta['updated']), delta['checkpoint']))
+        return delta
+
+    def _changed_since(self, mark):
+        """Yields the entities updated since the mark, in `updated` order.
+
+        Pages are requested from the last `updated` seen rather than by
+        offset, so entities updated while paging (which move to the end)
+        never make others skip a page boundary. Only the entities sharing
+        that last timestamp are skipped by offset, and deduplicated.
+        """
+        since, seen = mark, set()
+        while True:
+            filters = dict(self.filters, sort='updated', order='asc',
+                           limit=self.page_size, offset=len(seen))
+            if since is not None:
+                filters['since'] = since
+            entities, paging = self.entity.list(**filters)
+            for entity in entities:
+                updated = entity.to_dict().get('updated')
+                if updated != since:
+                    since, seen = updated, set()
+                elif entity._id in seen:
+                    continue
+                seen.add(entity._id)
+                yield entity
+            if not entities or not paging.get(
+                    'has_more', len(entities) == self.page_size):
+                return
+
+
+def sync_all(checkpoints, store,
+             entities=(api.Product, api.Order, api.Customer)):
+    """Syncs every entity class, returns the deltas keyed by class name"""
+    return dict((entity._kind, Syncer(entity, checkpoints, store).sync())
+                for entity in entities)
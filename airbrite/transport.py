@@ -0,0 +1,222 @@
+"""Transports carry the client's HTTP requests.
+
+By default a `client.Client` sends requests over its pooled
+`requests.Session`. Any object implementing `Transport` can be given
+instead, e.g. the in-memory Airbrite stand-in, to run tests, load tests
+and benchmarks without network or rate limits:
+
+    client = Client(transport=MemoryTransport())
+    airbrite.api.Entity.client = client
+
+Asynchronous use needs nothing more from a transport: the client runs the
+calls submitted to it (`afetch`, `fetch_many`...) on its worker threads.
+"""
+import copy
+import json
+import threading
+import time
+import urlparse
+from datetime import datetime
+
+import api
+import client
+
+
+class Transport (object):
+    """Sends a request, returns a response with `status_code`, `headers`,
+    `content` and `json()`, like `requests` does.
+
+    Unlike with `requests`, a gzip or deflate encoded `content` is left
+    encoded: the client decodes it.
+    """
+
+    def send(self, method, url, **params):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class Response (object):
+
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = json.dumps(body) if body is not None else ''
+
+    @property
+    def text(self):
+        return self.content
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        for start in xrange(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+
+###############################################################################
+
+class MemoryTransport (Transport):
+    """In-memory stand-in of the Airbrite API.
+
+    Implements create, retrieve, update and list (with paging and the
+    `limit`, `offset`, `sort`, `order`, `since` and `until` filters) of
+    products, orders, customers, and the shipments and payments of orders.
+    POSTs are deduplicated by Idempotency-Key, and GETs of an entity honor
+    If-None-Match. Gzipped request bodies are accepted, and responses of at
+    least `min_compress` bytes are gzipped when the client accepts it.
+    `latency` seconds are added to every request.
+    """
+
+    COLLECTIONS = ('products', 'orders', 'customers')
+    IN_ORDER = ('shipments', 'payments')
+
+    def __init__(self, latency=0, user_id='5237a347429acf0400000013',
+                 min_compress=1024, clock=time.time):
+        self.latency = latency
+        self.min_compress = min_compress
+        self.user_id = user_id
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._collections = {}
+        self._idempotent = {}
+        self._next_id = 0
+        self.requests = 0
+
+    def _route(self, url):
+        """Returns the collection key and the _id (or None) for the URL"""
+        path = urlparse.urlparse(url).path
+        prefix = urlparse.urlparse(api.END_POINT).path
+        parts = [p for p in path[len(prefix):].split('/') if p]
+        if parts and parts[0] in self.COLLECTIONS and len(parts) <= 2:
+            return parts[0], (parts[1] if len(parts) == 2 else None)
+        if len(parts) in (3, 4) and parts[0] == 'orders' and \
+                parts[2] in self.IN_ORDER:
+            return '/'.join(parts[:3]), (parts[3] if len(parts) == 4
+                                         else None)
+        return None, None
+
+    def _error(self, status_code, message):
+        return Response(status_code, {'data': message, 'meta': {}})
+
+    def send(self, method, url, params=None, data=None, headers=None,
+             **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        headers = headers or {}
+        if data is not None and headers.get('Content-Encoding'):
+            data = client.decompress(data, headers['Content-Encoding'])
+        response = self._handle(method, url, params, data, headers)
+
+        accepted = headers.get('Accept-Encoding', '')
+        if 'gzip' in accepted and len(response.content) >= self.min_compress:
+            response.content = client.compress(response.content)
+            response.headers.update({
+                'Content-Encoding': 'gzip',
+                'Content-Length': str(len(response.content)),
+            })
+        return response
+
+    def _handle(self, method, url, params, data, headers):
+        collection, _id = self._route(url)
+        if collection is None:
+            return self._error(404, 'Not found')
+
+        with self._lock:
+            self.requests += 1
+            records = self._collections.setdefault(collection, {})
+            if method == 'get' and _id is None:
+                return self._list(records, params or {})
+            if method == 'get':
+                return self._retrieve(records, _id, headers)
+            if method == 'post' and _id is None:
+                return self._create(collection, records,
+                                    json.loads(data or '{}'), headers)
+            if method == 'put' and _id is not None:
+                return self._update(records, _id, json.loads(data or '{}'))
+        return self._error(405, 'Method not allowed')
+
+    ###########################################################################
+
+    def _timestamps(self, record, *fields):
+        now = self.clock()
+        iso = datetime.utcfromtimestamp(now).isoformat()[:23] + 'Z'
+        for field in fields:
+            record[field] = int(now)
+            record[field + '_date'] = iso
+
+    def _etag(self, record):
+        return '"%s-%s"' % (record['_id'], record['_version'])
+
+    def _public(self, record):
+        return dict((k, copy.deepcopy(v)) for k, v in record.items()
+                    if k not in ('_seq', '_version'))
+
+    def _list(self, records, params):
+        matches = records.values()
+        since, until = params.get('since'), params.get('until')
+        if since is not None:
+            matches = [r for r in matches if r['updated'] >= int(since)]
+        if until is not None:
+            matches = [r for r in matches if r['updated'] <= int(until)]
+        sort = params.get('sort', 'created')
+        matches.sort(key=lambda r: (r.get(sort), r['_seq']),
+                     reverse=params.get('order', 'asc') == 'desc')
+
+        limit = int(params.get('limit', 100))
+        offset = int(params.get('offset', 0))
+        page = matches[offset:offset + limit]
+        return Response(200, {
+            'data': [self._public(r) for r in page],
+            'paging': {
+                'count': len(page),
+                'has_more': offset + len(page) < len(matches),
+                'limit': limit,
+                'offset': offset,
+                'total': len(matches),
+            },
+            'meta': {},
+        })
+
+    def _retrieve(self, records, _id, headers):
+        record = records.get(_id)
+        if record is None:
+            return self._error(404, 'Not found')
+        etag = self._etag(record)
+        if headers.get('If-None-Match') == etag:
+            return Response(304, headers={'ETag': etag})
+        return Response(200, {'data': self._public(record), 'meta': {}},
+                        {'ETag': etag})
+
+    def _create(self, collection, records, data, headers):
+        key = headers.get('Idempotency-Key')
+        if key is not None and key in self._idempotent:
+            return Response(201, self._idempotent[key])
+
+        self._next_id += 1
+        record = dict(data, _id='%024x' % self._next_id, user_id=self.user_id,
+                      _seq=self._next_id, _version=1)
+        record.setdefault('metadata', {})
+        self._timestamps(record, 'created', 'updated')
+        if '/' in collection:
+            record['order_id'] = collection.split('/')[1]
+        records[record['_id']] = record
+
+        body = {'data': self._public(record), 'meta': {}}
+        if key is not None:
+            self._idempotent[key] = body
+        return Response(201, body)
+
+    def _update(self, records, _id, data):
+        record = records.get(_id)
+        if record is None:
+            return self._error(404, 'Not found')
+        for field in ('_id', 'user_id', 'created', 'created_date', '_seq'):
+            data.pop(field, None)
+        record.update(data)
+        record['_version'] += 1
+        self._timestamps(record, 'updated')
+        return Response(200, {'data': self._public(record), 'meta': {}})
@@ -0,0 +1,83 @@
+"""Memory taken by entities, in the regular and the compact layouts.
+
+    python benchmarks/memory.py [count]
+
+Builds `count` products (200000 by default) from typical API data in each
+layout, and reports the memory the process grew by, and the bytes taken
+per entity by its own containers (the field values are the same objects in
+both layouts, and not counted).
+"""
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from airbrite import Product  # noqa
+
+
+def record(i):
+    return {
+        u'_id': u'%024x' % i,
+        u'created': 1379378436 + i,
+        u'created_date': u'2013-09-17T00:40:36.649Z',
+        u'description': u'Product %d' % i,
+        u'inventory': None,
+        u'metadata': {},
+        u'name': None,
+        u'sku': u'product-%d' % i,
+        u'updated': 1379378436 + i,
+        u'updated_date': u'2013-09-17T00:40:36.649Z',
+        u'user_id': u'5237a347429acf0400000013',
+        u'weight': None,
+    }
+
+
+def max_rss():
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def own_size(entity):
+    size = sys.getsizeof(entity)
+    if hasattr(entity, '_values'):
+        return size + sys.getsizeof(entity._values) + \
+            sys.getsizeof(entity._extra)
+    return size + sys.getsizeof(entity.__dict__) + \
+        sys.getsizeof(entity._data)
+
+
+def run(entity, count):
+    """Run in a child process, so each layout starts from a fresh heap"""
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return
+    records = [record(i) for i in xrange(count)]
+    before = max_rss()
+    started = time.time()
+    if entity is Product:
+        # The regular layout keeps the given dict, give it its own
+        entities = [entity(**dict(data)) for data in records]
+    else:
+        entities = [entity(**data) for data in records]
+    built = time.time() - started
+    grown = max_rss() - before
+
+    started = time.time()
+    for e in entities:
+        e.sku, e.description, e.metadata
+    read = time.time() - started
+
+    print('%-16s %7.1f MB  %5d B/entity  built in %.2fs, read in %.2fs'
+          % (entity.__name__, grown / 1e6, own_size(entities[0]), built,
+             read))
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    print('%d products' % count)
+    for entity in (Product, Product.compact()):
+        run(entity, count)
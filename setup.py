@@ -12,7 +12,8 @@ setup(
     author='Elvio Toccalino',
     author_email='etoccalino@creativa77.com.ar',
     url='https://www.airbrite.io/',
-    install_requires=['requests >= 2.0.0', 'nose >= 1.3.0'],
+    install_requires=['requests >= 2.0.0', 'futures >= 2.1.0',
+                      'nose >= 1.3.0'],
     packages=['airbrite', 'tests.unittests', 'tests.integration'],
     test_suite='tests.unittests'
 )
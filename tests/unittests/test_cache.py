@@ -0,0 +1,142 @@
+import copy
+import unittest
+import airbrite
+import airbrite.cache
+import airbrite.client
+import mock
+
+from utils import TestClient
+
+
+class Clock (object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class EntityCacheTestCase (unittest.TestCase):
+
+    def setUp(self):
+        super(EntityCacheTestCase, self).setUp()
+        self.clock = Clock()
+        self.cache = airbrite.cache.EntityCache(maxsize=2, ttl=10,
+                                                ttls={'Order': 0},
+                                                clock=self.clock)
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.cache.get(airbrite.Product, 'a'))
+        self.cache.set(airbrite.Product, 'a', {'_id': 'a'})
+        self.assertEqual(self.cache.get(airbrite.Product, 'a'), {'_id': 'a'})
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_returns_copies(self):
+        self.cache.set(airbrite.Product, 'a', {'metadata': {}})
+        self.cache.get(airbrite.Product, 'a')['metadata']['k'] = 'v'
+        self.assertEqual(self.cache.get(airbrite.Product, 'a'),
+                         {'metadata': {}})
+
+    def test_ttl(self):
+        self.cache.set(airbrite.Product, 'a', {'_id': 'a'})
+        self.clock.now += 11
+        self.assertIsNone(self.cache.get(airbrite.Product, 'a'))
+        self.assertEqual(self.cache.stats()['expirations'], 1)
+
+    def test_stale(self):
+        self.cache.set(airbrite.Product, 'a', {'_id': 'a'})
+        self.clock.now += 11
+        self.assertIsNone(self.cache.get(airbrite.Product, 'a'))
+        self.assertEqual(self.cache.get(airbrite.Product, 'a', stale=True),
+                         {'_id': 'a'})
+        self.assertEqual(self.cache.stats()['stale_hits'], 1)
+
+    def test_class_not_cached(self):
+        self.cache.set(airbrite.Order, 'a', {'_id': 'a'})
+        self.assertEqual(len(self.cache), 0)
+        # Compact entities are of the same kind
+        self.cache.set(airbrite.Order.compact(), 'a', {'_id': 'a'})
+        self.assertEqual(len(self.cache), 0)
+
+    def test_lru_eviction(self):
+        self.cache.set(airbrite.Product, 'a', {})
+        self.cache.set(airbrite.Product, 'b', {})
+        self.cache.get(airbrite.Product, 'a')
+        self.cache.set(airbrite.Product, 'c', {})
+        self.assertIsNotNone(self.cache.get(airbrite.Product, 'a'))
+        self.assertIsNone(self.cache.get(airbrite.Product, 'b'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+
+class CachedProductTestCase (unittest.TestCase):
+
+    DATA1 = TestClient.CANNED[airbrite.Product][0]
+
+    def setUp(self):
+        super(CachedProductTestCase, self).setUp()
+        self._client = airbrite.Product.client
+        self.client = airbrite.Product.client = TestClient(airbrite.Product)
+        self.client.get = self.counted(self.client.get)
+        self.cache = airbrite.Product.cache = airbrite.cache.EntityCache()
+
+    def tearDown(self):
+        super(CachedProductTestCase, self).tearDown()
+        airbrite.Product.client = self._client
+        del airbrite.Product.cache
+
+    def counted(self, get):
+        self.gets = 0
+
+        def _get(*args, **kwargs):
+            self.gets += 1
+            # Copy, so saving doesn't alter the canned data
+            return copy.deepcopy(get(*args, **kwargs))
+        return _get
+
+    def test_fetch_is_cached(self):
+        airbrite.Product.fetch(_id=self.DATA1['_id'])
+        product = airbrite.Product.fetch(_id=self.DATA1['_id'])
+        self.assertEqual(product.sku, self.DATA1['sku'])
+        self.assertEqual(self.gets, 1)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_refresh_uncached(self):
+        product = airbrite.Product.fetch(_id=self.DATA1['_id'])
+        product.refresh(cached=False)
+        self.assertEqual(self.gets, 2)
+
+    def test_save_writes_through(self):
+        product = airbrite.Product.fetch(_id=self.DATA1['_id'])
+        product.name = 'a new name'
+        product.save()
+        product = airbrite.Product.fetch(_id=self.DATA1['_id'])
+        self.assertEqual(product.name, 'a new name')
+        self.assertEqual(self.gets, 1)
+
+    def test_create_writes_through(self):
+        product = airbrite.Product.create(sku='foo')
+        self.assertEqual(airbrite.Product.fetch(_id=product._id).sku, 'foo')
+        self.assertEqual(self.gets, 0)
+
+    def test_fallback_when_circuit_open(self):
+        url = airbrite.Product(_id=self.DATA1['_id']).instance_url()
+        self.cache.set(airbrite.Product, url, self.DATA1)
+        self.cache.clock = lambda: float('inf')
+        self.client.get = mock.MagicMock(
+            side_effect=airbrite.client.CircuitOpen())
+        product = airbrite.Product.fetch(_id=self.DATA1['_id'])
+        self.assertEqual(product.sku, self.DATA1['sku'])
+
+    def test_no_fallback_without_cached_copy(self):
+        self.client.get = mock.MagicMock(
+            side_effect=airbrite.client.CircuitOpen())
+        self.assertRaises(airbrite.client.CircuitOpen,
+                          airbrite.Product.fetch, _id=self.DATA1['_id'])
+
+    def test_get_product(self):
+        airbrite.get_product(self.DATA1['_id'])
+        airbrite.get_product(self.DATA1['_id'])
+        self.assertEqual(self.gets, 1)
@@ -1,8 +1,18 @@
+import datetime
+import os
+import shutil
+import tempfile
 import unittest
+import threading
+import time
 import json
+import zlib
 import mock
+import requests
 
+import airbrite
 import airbrite.client
+import airbrite.codec
 
 
 class ClientData (unittest.TestCase):
@@ -30,9 +40,9 @@ class ClientMethods (unittest.TestCase):
     def setUp(self):
         super(ClientMethods, self).setUp()
 
-        self.get_patcher = mock.patch('requests.get')
-        self.put_patcher = mock.patch('requests.put')
-        self.post_patcher = mock.patch('requests.post')
+        self.get_patcher = mock.patch('requests.Session.get')
+        self.put_patcher = mock.patch('requests.Session.put')
+        self.post_patcher = mock.patch('requests.Session.post')
         self._get = self.get_patcher.start()
         self._put = self.put_patcher.start()
         self._post = self.post_patcher.start()
@@ -49,7 +59,7 @@ class ClientMethods (unittest.TestCase):
     def test_get_by_id(self):
         ret = mock.MagicMock()
         ret.status_code = 200
-        ret.json = mock.MagicMock(return_value=dict())
+        ret.content = json.dumps(dict())
         self._get.return_value = ret
 
         res = self.client.get(self.url, _id='some_id')
@@ -69,7 +79,7 @@ class ClientMethods (unittest.TestCase):
     def test_get_all(self):
         ret = mock.MagicMock()
         ret.status_code = 200
-        ret.json = mock.MagicMock(return_value={
+        ret.content = json.dumps({
             'data': [{
             }],
             'meta': {
@@ -93,7 +103,7 @@ class ClientMethods (unittest.TestCase):
         data = {'key': 'value'}
         ret = mock.MagicMock()
         ret.status_code = 200
-        ret.json = mock.MagicMock(return_value={
+        ret.content = json.dumps({
             'data': data,
             'meta': {}
         })
@@ -109,8 +119,11 @@ class ClientMethods (unittest.TestCase):
 
         self._post.assert_called_once_with(self.url,
                                            auth=self.client.auth,
-                                           headers=self.client.headers,
-                                           data=json.dumps(data))
+                                           headers=mock.ANY,
+                                           timeout=self.client.timeout,
+                                           data=self.client.codec.dumps(data))
+        headers = self._post.call_args[1]['headers']
+        self.assertTrue('Idempotency-Key' in headers)
         self._put.assert_not_called()
 
     def test_put_single(self):
@@ -118,7 +131,7 @@ class ClientMethods (unittest.TestCase):
         data = {'_id': 'some-id', 'key': 'value'}
         ret = mock.MagicMock()
         ret.status_code = 200
-        ret.json = mock.MagicMock(return_value={
+        ret.content = json.dumps({
             'data': data,
             'meta': {}
         })
@@ -135,5 +148,761 @@ class ClientMethods (unittest.TestCase):
         self._put.assert_called_once_with(self.url,
                                           auth=self.client.auth,
                                           headers=self.client.headers,
-                                          data=json.dumps(data))
+                                          timeout=self.client.timeout,
+                                          data=self.client.codec.dumps(data))
         self._post.assert_not_called()
+
+
+class ClientPooling (unittest.TestCase):
+
+    def test_session_is_reused(self):
+        client = airbrite.client.Client()
+        self.assertIs(client.session, client.session)
+
+    def test_thread_local_sessions(self):
+        client = airbrite.client.Client(thread_local=True)
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(
+            client.session))
+        thread.start()
+        thread.join()
+        self.assertIsNot(sessions[0], client.session)
+        self.assertIs(client.session, client.session)
+
+    def test_thread_sessions_released(self):
+        client = airbrite.client.Client(thread_local=True)
+        client.session
+        threads = [threading.Thread(target=lambda: client.session)
+                   for _ in range(50)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+        # A thread's locals are dropped just after it is joined
+        for _ in range(100):
+            if client.pool_stats()['sessions'] == 1:
+                break
+            time.sleep(0.01)
+        self.assertEqual(client.pool_stats()['sessions'], 1)
+        client.close()
+        self.assertEqual(client.pool_stats()['sessions'], 0)
+
+    def test_pool_size(self):
+        client = airbrite.client.Client(pool_maxsize=3)
+        adapter = client.session.get_adapter(client.endpoint)
+        self.assertEqual(adapter._pool_maxsize, 3)
+
+    def test_pool_stats(self):
+        client = airbrite.client.Client()
+        client.session
+        stats = client.pool_stats()
+        self.assertEqual(stats['sessions'], 1)
+        self.assertEqual(stats['requests'], 0)
+        self.assertEqual(stats['reuse_rate'], 0.0)
+
+    def test_close(self):
+        client = airbrite.client.Client()
+        session = client.session
+        client.close()
+        self.assertIsNot(session, client.session)
+
+
+class ClientSubmit (unittest.TestCase):
+
+    def setUp(self):
+        super(ClientSubmit, self).setUp()
+        self.client = airbrite.client.Client(max_workers=1)
+
+    def tearDown(self):
+        super(ClientSubmit, self).tearDown()
+        self.client.close()
+
+    def test_submit(self):
+        future = self.client.submit(lambda x: x * 2, 21)
+        self.assertEqual(future.result(), 42)
+
+    def test_cancel_pending(self):
+        started, release = threading.Event(), threading.Event()
+
+        def block():
+            started.set()
+            release.wait()
+
+        running = self.client.submit(block)
+        started.wait()
+        pending = self.client.submit(lambda: 'never')
+        self.assertTrue(pending.cancel())
+        release.set()
+        running.result()
+        self.assertTrue(pending.cancelled())
+
+
+class ClientConditionalGet (unittest.TestCase):
+
+    def setUp(self):
+        super(ClientConditionalGet, self).setUp()
+        self.get_patcher = mock.patch('requests.Session.get')
+        self._get = self.get_patcher.start()
+        self.client = airbrite.client.Client()
+        self.url = '/tests/some-id'
+
+    def tearDown(self):
+        super(ClientConditionalGet, self).tearDown()
+        self.get_patcher.stop()
+
+    def respond(self, status_code, data=None, headers={}):
+        ret = mock.MagicMock()
+        ret.status_code = status_code
+        ret.headers = headers
+        ret.content = json.dumps(data)
+        self._get.return_value = ret
+
+    def sent_headers(self):
+        return self._get.call_args[1]['headers']
+
+    def test_unconditional(self):
+        self.respond(200, {'data': {'updated': 10}})
+        self.assertEqual(self.client.get_if_modified(self.url),
+                         {'data': {'updated': 10}})
+        self.assertFalse('If-None-Match' in self.sent_headers())
+        self.assertFalse('If-Modified-Since' in self.sent_headers())
+
+    def test_etag_revalidation(self):
+        self.respond(200, {'data': {'updated': 10}}, {'ETag': '"v1"'})
+        self.client.get_if_modified(self.url)
+
+        self.respond(304)
+        self.assertIsNone(self.client.get_if_modified(self.url, updated=10))
+        self.assertEqual(self.sent_headers()['If-None-Match'], '"v1"')
+        self.assertEqual(self.client.stats()['not_modified'], 1)
+
+    def test_stale_copy_not_revalidated_by_etag(self):
+        self.respond(200, {'data': {'updated': 10}}, {'ETag': '"v1"'})
+        self.client.get_if_modified(self.url)
+
+        self.respond(200, {'data': {'updated': 10}})
+        self.client.get_if_modified(self.url, updated=5)
+        self.assertFalse('If-None-Match' in self.sent_headers())
+        self.assertEqual(self.sent_headers()['If-Modified-Since'],
+                         'Thu, 01 Jan 1970 00:00:05 GMT')
+
+    def test_validators_bounded(self):
+        self.client.max_validators = 2
+        for url in ('/tests/a', '/tests/b', '/tests/c'):
+            self.respond(200, {'data': {'updated': 10}}, {'ETag': '"v1"'})
+            self.client.get_if_modified(url)
+        self.assertEqual(list(self.client._validators),
+                         ['/tests/b', '/tests/c'])
+
+
+class ClientSingleFlight (unittest.TestCase):
+
+    def setUp(self):
+        super(ClientSingleFlight, self).setUp()
+        self.get_patcher = mock.patch('requests.Session.get')
+        self._get = self.get_patcher.start()
+        self.client = airbrite.client.Client()
+
+        self.release = threading.Event()
+
+        def slow_get(*args, **kwargs):
+            self.release.wait()
+            ret = mock.MagicMock()
+            ret.status_code = 200
+            ret.content = json.dumps({'data': {'_id': 'x'}})
+            return ret
+        self._get.side_effect = slow_get
+
+    def tearDown(self):
+        super(ClientSingleFlight, self).tearDown()
+        self.get_patcher.stop()
+
+    def run_concurrently(self, n, fn):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(fn()))
+                   for _ in range(n)]
+        for thread in threads:
+            thread.start()
+        # Let every thread reach the in-flight call before answering
+        while self.client.stats().get('collapsed', 0) < n - 1:
+            time.sleep(0.001)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_identical_gets_collapse(self):
+        results = self.run_concurrently(
+            5, lambda: self.client.get('/tests/x', limit=1))
+        self.assertEqual(self._get.call_count, 1)
+        self.assertEqual(results, [{'data': {'_id': 'x'}}] * 5)
+        self.assertEqual(self.client.stats()['collapsed'], 4)
+        # Every caller gets its own copy
+        self.assertEqual(len(set(id(r) for r in results)), 5)
+
+    def test_list_params_collapse(self):
+        results = self.run_concurrently(
+            3, lambda: self.client.get('/tests', ids=['a', 'b']))
+        self.assertEqual(self._get.call_count, 1)
+        self.assertEqual(len(results), 3)
+
+    def test_unencodable_params_not_collapsed(self):
+        self.release.set()
+        self.client.get('/tests', since=datetime.date(2014, 1, 1))
+        self.assertEqual(self._get.call_count, 1)
+        self.assertFalse('collapsed' in self.client.stats())
+
+    def test_disabled(self):
+        self.client.single_flight = False
+        self.release.set()
+        self.client.get('/tests/x')
+        self.client.get('/tests/x')
+        self.assertEqual(self._get.call_count, 2)
+
+
+class ClientRetries (unittest.TestCase):
+
+    def setUp(self):
+        super(ClientRetries, self).setUp()
+        self.get_patcher = mock.patch('requests.Session.get')
+        self.post_patcher = mock.patch('requests.Session.post')
+        self._get = self.get_patcher.start()
+        self._post = self.post_patcher.start()
+
+        self.client = airbrite.client.Client(single_flight=False)
+        self.client.sleep = mock.MagicMock()
+
+    def tearDown(self):
+        super(ClientRetries, self).tearDown()
+        self.get_patcher.stop()
+        self.post_patcher.stop()
+
+    def response(self, status_code, headers={}):
+        ret = mock.MagicMock()
+        ret.status_code = status_code
+        ret.headers = headers
+        ret.content = json.dumps({'data': {}})
+        return ret
+
+    def test_retry_then_succeed(self):
+        self._get.side_effect = [self.response(503), self.response(200)]
+        self.assertEqual(self.client.get('/tests'), {'data': {}})
+        self.assertEqual(self._get.call_count, 2)
+        self.assertEqual(self.client.stats()['retries'], 1)
+        delay = self.client.sleep.call_args[0][0]
+        self.assertTrue(0 <= delay <= 0.5)
+
+    def test_retry_after(self):
+        self._get.side_effect = [self.response(429, {'Retry-After': '7'}),
+                                 self.response(200)]
+        self.client.get('/tests')
+        self.client.sleep.assert_called_once_with(7.0)
+
+    def test_retry_after_capped(self):
+        self._get.side_effect = [
+            self.response(503, {'Retry-After': '86400'}),
+            self.response(200)]
+        self.client.get('/tests')
+        self.client.sleep.assert_called_once_with(30.0)
+
+    def test_retried_response_closed(self):
+        failed = self.response(503)
+        self._get.side_effect = [failed, self.response(200)]
+        self.client.request('get', '/tests', stream=True)
+        self.assertTrue(failed.close.called)
+
+    def test_connection_error(self):
+        self._get.side_effect = [requests.ConnectionError(),
+                                 self.response(200)]
+        self.assertEqual(self.client.get('/tests'), {'data': {}})
+
+    def test_gives_up(self):
+        self._get.return_value = self.response(503)
+        self.assertRaises(Exception, self.client.get, '/tests')
+        self.assertEqual(self._get.call_count, 3)
+
+    def test_deadline(self):
+        self.client.retry = airbrite.client.RetryPolicy(deadline=5)
+        self._get.side_effect = [self.response(503, {'Retry-After': '10'}),
+                                 self.response(200)]
+        self.assertRaises(Exception, self.client.get, '/tests')
+        self.assertEqual(self._get.call_count, 1)
+
+    def test_no_status_retry(self):
+        self._get.return_value = self.response(404)
+        self.assertRaises(Exception, self.client.get, '/tests')
+        self.assertEqual(self._get.call_count, 1)
+
+    def test_post_without_key_not_retried(self):
+        self._post.return_value = self.response(503)
+        self.client.request('post', '/tests', data='{}')
+        self.assertEqual(self._post.call_count, 1)
+
+    def test_post_retried_under_same_key(self):
+        self._post.side_effect = [self.response(503), self.response(201)]
+        self.client.post('/tests', idempotency_key='op-1')
+        self.assertEqual(self._post.call_count, 2)
+        keys = [c[1]['headers']['Idempotency-Key']
+                for c in self._post.call_args_list]
+        self.assertEqual(keys, ['op-1', 'op-1'])
+
+
+class ClientIdempotency (unittest.TestCase):
+
+    def setUp(self):
+        super(ClientIdempotency, self).setUp()
+        self.post_patcher = mock.patch('requests.Session.post')
+        self._post = self.post_patcher.start()
+        ret = mock.MagicMock()
+        ret.status_code = 201
+        ret.content = json.dumps({'data': {'_id': 'new'}})
+        self._post.return_value = ret
+
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'journal.json')
+        self.client = airbrite.client.Client(
+            journal=airbrite.client.FileIdempotencyJournal(self.path))
+
+    def tearDown(self):
+        super(ClientIdempotency, self).tearDown()
+        self.post_patcher.stop()
+        self.client.journal.close()
+        shutil.rmtree(self.dir)
+
+    def test_new_key_per_post(self):
+        self.client.post('/tests')
+        self.client.post('/tests')
+        keys = set(c[1]['headers']['Idempotency-Key']
+                   for c in self._post.call_args_list)
+        self.assertEqual(len(keys), 2)
+        # Generated keys can't be repeated, so they are not journaled
+        self.assertEqual(os.path.getsize(self.path), 0)
+
+    def test_completed_post_not_repeated(self):
+        self.client.post('/tests', idempotency_key='op-1', sku='foo')
+        # As if the worker restarted
+        client = airbrite.client.Client(
+            journal=airbrite.client.FileIdempotencyJournal(self.path))
+        data = client.post('/tests', idempotency_key='op-1', sku='foo')
+        self.assertEqual(data, {'data': {'_id': 'new'}})
+        self.assertEqual(self._post.call_count, 1)
+        self.assertEqual(client.stats()['deduplicated'], 1)
+
+    def test_pending_post_resent(self):
+        self.client.journal.begin('op-1')
+        self.client.post('/tests', idempotency_key='op-1')
+        self.assertEqual(self._post.call_count, 1)
+        self.assertEqual(self.client.journal.get('op-1')['state'], 'done')
+
+    def test_records_expire(self):
+        now = [1000.0]
+        journal = airbrite.client.IdempotencyJournal(
+            ttl=60, clock=lambda: now[0])
+        journal.complete('op-1', {'data': {}})
+        now[0] += 30
+        journal.complete('op-2', {'data': {}})
+        now[0] += 40
+        self.assertIsNone(journal.get('op-1'))
+        self.assertEqual(journal.get('op-2')['state'], 'done')
+        self.assertEqual(list(journal._records), ['op-2'])
+
+    def test_file_appended_and_compacted(self):
+        journal = self.client.journal
+        journal.begin('op-1')
+        journal.complete('op-1', {'data': {}})
+        with open(self.path) as f:
+            self.assertEqual(len(f.readlines()), 2)
+        for i in xrange(100):
+            journal.complete('op-1', {'data': {}})
+        with open(self.path) as f:
+            self.assertTrue(len(f.readlines()) <= 66)
+        # A line cut short by a crash is skipped
+        with open(self.path, 'a') as f:
+            f.write('["op-2", {"sta')
+        reopened = airbrite.client.FileIdempotencyJournal(self.path)
+        self.assertEqual(list(reopened._records), ['op-1'])
+        reopened.close()
+
+
+class ClientDeadline (unittest.TestCase):
+
+    def setUp(self):
+        super(ClientDeadline, self).setUp()
+        self.get_patcher = mock.patch('requests.Session.get')
+        self._get = self.get_patcher.start()
+        self._get.return_value.status_code = 200
+        self._get.return_value.content = '{}'
+        self.client = airbrite.client.Client(timeout=(3, 10))
+        self.client.sleep = mock.MagicMock()
+
+    def tearDown(self):
+        super(ClientDeadline, self).tearDown()
+        self.get_patcher.stop()
+        self.client.close()
+
+    def test_default_timeout(self):
+        self.client.get('/tests')
+        self.assertEqual(self._get.call_args[1]['timeout'], (3, 10))
+
+    def test_timeout_bounded_by_deadline(self):
+        with airbrite.deadline(0.8):
+            self.client.get('/tests')
+        connect, read = self._get.call_args[1]['timeout']
+        self.assertTrue(0 < connect <= 0.8)
+        self.assertTrue(0 < read <= 0.8)
+
+    def test_expired_deadline(self):
+        with airbrite.deadline(0):
+            self.assertRaises(airbrite.DeadlineExceeded, self.client.get,
+                              '/tests')
+
+    def test_get_product_deadline_propagates(self):
+        with airbrite.deadline(0):
+            self.assertRaises(airbrite.DeadlineExceeded,
+                              airbrite.get_product, 'foo')
+        self._get.assert_not_called()
+
+    def test_nested_deadlines(self):
+        with airbrite.deadline(0.5):
+            with airbrite.deadline(10):
+                self.assertTrue(airbrite.client.remaining() <= 0.5)
+        self.assertIsNone(airbrite.client.remaining())
+
+    def test_no_retry_past_deadline(self):
+        self._get.return_value.status_code = 503
+        self._get.return_value.headers = {'Retry-After': '5'}
+        with airbrite.deadline(1):
+            self.assertRaises(airbrite.DeadlineExceeded, self.client.get,
+                              '/tests')
+        self.assertEqual(self._get.call_count, 1)
+
+    def test_deadline_propagates_to_workers(self):
+        with airbrite.deadline(0):
+            future = self.client.submit(airbrite.client.remaining)
+        self.assertTrue(future.result() <= 0)
+
+
+class ClientHedging (unittest.TestCase):
+
+    def setUp(self):
+        super(ClientHedging, self).setUp()
+        self.get_patcher = mock.patch('requests.Session.get')
+        self._get = self.get_patcher.start()
+        self.client = airbrite.client.Client(
+            single_flight=False,
+            hedge=airbrite.client.HedgePolicy(min_delay=0.05, max_ratio=1))
+
+    def tearDown(self):
+        super(ClientHedging, self).tearDown()
+        self.get_patcher.stop()
+        self.client.close()
+
+    def response(self, body):
+        ret = mock.MagicMock()
+        ret.status_code = 200
+        ret.content = json.dumps(body)
+        # Made up front, as answers are closed from other threads
+        ret.close = mock.MagicMock()
+        return ret
+
+    def test_fast_answer_not_hedged(self):
+        self._get.return_value = self.response({'data': 'first'})
+        self.assertEqual(self.client.get('/tests'), {'data': 'first'})
+        self.assertEqual(self._get.call_count, 1)
+        self.assertFalse('hedges' in self.client.stats())
+
+    def wait_closed(self, response):
+        for _ in range(100):
+            if response.close.called:
+                break
+            time.sleep(0.01)
+        return response.close.called
+
+    def test_slow_answer_hedged(self):
+        release = threading.Event()
+        slow = self.response({'data': 'slow'})
+        answers = iter([(slow, release.wait),
+                        (self.response({'data': 'hedge'}), lambda: None)])
+
+        def get(*args, **kwargs):
+            response, wait = next(answers)
+            wait()
+            return response
+        self._get.side_effect = get
+
+        self.assertEqual(self.client.get('/tests'), {'data': 'hedge'})
+        release.set()
+        # The slow answer is released once it comes
+        self.assertTrue(self.wait_closed(slow))
+        stats = self.client.stats()
+        self.assertEqual(stats['hedges'], 1)
+        self.assertEqual(stats['hedge_wins'], 1)
+
+    def test_slow_failure_hedged(self):
+        calls = []
+
+        def get(*args, **kwargs):
+            calls.append(True)
+            if len(calls) == 1:
+                # Slower than the hedging delay, then failing
+                time.sleep(0.1)
+                raise requests.ConnectionError()
+            time.sleep(0.1)
+            return self.response({'data': 'hedge'})
+        self._get.side_effect = get
+
+        self.assertEqual(self.client.get('/tests'), {'data': 'hedge'})
+        stats = self.client.stats()
+        self.assertEqual(stats['hedges'], 1)
+        self.assertEqual(stats['hedge_wins'], 1)
+
+    def test_losing_hedge_closed(self):
+        hedge = self.response({'data': 'hedge'})
+        answers = iter([(self.response({'data': 'first'}), 0.1),
+                        (hedge, 0.3)])
+
+        def get(*args, **kwargs):
+            response, latency = next(answers)
+            time.sleep(latency)
+            return response
+        self._get.side_effect = get
+
+        self.assertEqual(self.client.get('/tests'), {'data': 'first'})
+        self.assertEqual(self.client.stats()['hedges'], 1)
+        self.assertFalse('hedge_wins' in self.client.stats())
+        self.assertTrue(self.wait_closed(hedge))
+
+    def test_deadline_bounds_wait(self):
+        release = threading.Event()
+        self._get.side_effect = lambda *args, **kwargs: release.wait()
+        started = time.time()
+        with airbrite.deadline(0.1):
+            self.assertRaises(airbrite.DeadlineExceeded, self.client.get,
+                              '/tests')
+        release.set()
+        self.assertTrue(time.time() - started < 1)
+
+    def test_failure_without_hedge(self):
+        self.client.retry = airbrite.client.RetryPolicy(max_attempts=1)
+        self._get.side_effect = requests.ConnectionError()
+        self.assertRaises(requests.ConnectionError, self.client.get,
+                          '/tests')
+        self.assertFalse('hedges' in self.client.stats())
+
+    def test_stream_not_hedged(self):
+        def get(*args, **kwargs):
+            # Slower than the hedging delay
+            time.sleep(0.1)
+            ret = self.response({'data': []})
+            ret.iter_content.return_value = [ret.content]
+            return ret
+        self._get.side_effect = get
+
+        self.assertEqual(list(self.client.stream('/tests')), [])
+        self.assertEqual(self._get.call_count, 1)
+        self.assertFalse('hedges' in self.client.stats())
+
+    def test_hedge_budget(self):
+        policy = airbrite.client.HedgePolicy(max_ratio=0.1)
+        policy.delay()
+        self.assertFalse(policy.allow())
+        for _ in range(9):
+            policy.delay()
+        self.assertTrue(policy.allow())
+        self.assertFalse(policy.allow())
+
+    def test_percentile_delay(self):
+        policy = airbrite.client.HedgePolicy(percentile=90, min_delay=0,
+                                             min_samples=10)
+        for latency in range(1, 11):
+            policy.record(latency / 10.0)
+        self.assertEqual(policy.delay(), 0.9)
+        policy.record(2.0)
+        self.assertEqual(policy.delay(), 1.0)
+
+
+class ClientCircuitBreaker (unittest.TestCase):
+
+    def setUp(self):
+        super(ClientCircuitBreaker, self).setUp()
+        self.get_patcher = mock.patch('requests.Session.get')
+        self._get = self.get_patcher.start()
+        self._get.return_value.status_code = 503
+
+        self.now = 1000.0
+        self.breaker = airbrite.client.CircuitBreaker(
+            failure_threshold=2, reset_timeout=10, clock=lambda: self.now)
+        self.client = airbrite.client.Client(
+            single_flight=False, breaker=self.breaker,
+            retry=airbrite.client.RetryPolicy(max_attempts=1))
+        self.url = airbrite.Product.collection_url()
+
+    def tearDown(self):
+        super(ClientCircuitBreaker, self).tearDown()
+        self.get_patcher.stop()
+
+    def test_endpoint_family(self):
+        family = airbrite.client.endpoint_family
+        self.assertEqual(family(self.url), 'products')
+        self.assertEqual(family(self.url + '/some-id'), 'products')
+        self.assertEqual(family(airbrite.Shipment.collection_url(
+            order_id='abc') + '/some-id'), 'orders/*/shipments')
+
+    def test_opens_after_failures(self):
+        self.assertRaises(Exception, self.client.get, self.url)
+        self.assertEqual(self.breaker.state('products'), 'closed')
+        self.assertRaises(Exception, self.client.get, self.url)
+        self.assertEqual(self.breaker.state('products'), 'open')
+
+        self.assertRaises(airbrite.client.CircuitOpen, self.client.get,
+                          self.url)
+        self.assertEqual(self._get.call_count, 2)
+        self.assertEqual(self.client.stats()['circuit_open'], 1)
+        # Other families are unaffected
+        self.assertEqual(self.breaker.state('orders'), 'closed')
+
+    def test_half_open_trial(self):
+        self.breaker.failure('products')
+        self.breaker.failure('products')
+        self.now += 10
+        self._get.return_value.status_code = 200
+        self._get.return_value.content = '{}'
+        self.client.get(self.url)
+        self.assertEqual(self.breaker.state('products'), 'closed')
+
+    def test_failed_trial_reopens(self):
+        self.breaker.failure('products')
+        self.breaker.failure('products')
+        self.now += 10
+        self.assertRaises(Exception, self.client.get, self.url)
+        self.assertEqual(self.breaker.state('products'), 'open')
+        self.assertRaises(airbrite.client.CircuitOpen, self.client.get,
+                          self.url)
+
+    def test_aborted_trial(self):
+        self.breaker.failure('products')
+        self.breaker.failure('products')
+        self.now += 10
+        with airbrite.client.deadline(0):
+            self.assertRaises(airbrite.client.DeadlineExceeded,
+                              self.client.get, self.url)
+        self.assertEqual(self.breaker.state('products'), 'open')
+        self._get.assert_not_called()
+        # The next call is the trial
+        self._get.return_value.status_code = 200
+        self._get.return_value.content = '{}'
+        self.client.get(self.url)
+        self.assertEqual(self.breaker.state('products'), 'closed')
+
+    def test_trial_failing_unexpectedly(self):
+        self.breaker.failure('products')
+        self.breaker.failure('products')
+        self.now += 10
+        self._get.side_effect = requests.TooManyRedirects()
+        self.assertRaises(requests.TooManyRedirects, self.client.get,
+                          self.url)
+        self.assertEqual(self.breaker.state('products'), 'open')
+        self.now += 10
+        self._get.side_effect = None
+        self._get.return_value.status_code = 200
+        self._get.return_value.content = '{}'
+        self.client.get(self.url)
+        self.assertEqual(self.breaker.state('products'), 'closed')
+
+
+class ClientCodec (unittest.TestCase):
+
+    class MarkingCodec (airbrite.codec.JSONCodec):
+        """Marks what it encodes and decodes"""
+
+        def dumps(self, obj):
+            return json.dumps(dict(obj, encoded=True))
+
+        def loads(self, content):
+            return dict(json.loads(content), decoded=True)
+
+    def setUp(self):
+        super(ClientCodec, self).setUp()
+        self.put_patcher = mock.patch('requests.Session.put')
+        self._put = self.put_patcher.start()
+        self._put.return_value.status_code = 200
+        self._put.return_value.content = '{"data": {}}'
+
+    def tearDown(self):
+        super(ClientCodec, self).tearDown()
+        self.put_patcher.stop()
+
+    def test_default_codec(self):
+        client = airbrite.client.Client()
+        self.assertTrue(isinstance(client.codec, airbrite.codec.JSONCodec))
+        self.assertEqual(client.codec.loads(client.codec.dumps({'a': [1]})),
+                         {'a': [1]})
+
+    def test_decodes_response_bytes(self):
+        client = airbrite.client.Client(codec=airbrite.codec.JSONCodec())
+        self.assertEqual(client.put('/tests', sku='foo'), {'data': {}})
+        self._put.return_value.json.assert_not_called()
+
+    def test_custom_codec(self):
+        client = airbrite.client.Client(codec=self.MarkingCodec())
+        data = client.put('/tests', sku='foo')
+        self.assertEqual(data, {'data': {}, 'decoded': True})
+        sent = json.loads(self._put.call_args[1]['data'])
+        self.assertEqual(sent, {'sku': 'foo', 'encoded': True})
+
+
+class ClientCompression (unittest.TestCase):
+
+    def setUp(self):
+        super(ClientCompression, self).setUp()
+        self.put_patcher = mock.patch('requests.Session.put')
+        self._put = self.put_patcher.start()
+        self._put.return_value.status_code = 200
+        self._put.return_value.headers = {}
+        self._put.return_value.content = '{"data": {}}'
+        self.client = airbrite.client.Client(
+            compression=airbrite.client.Compression(min_size=100))
+
+    def tearDown(self):
+        super(ClientCompression, self).tearDown()
+        self.put_patcher.stop()
+
+    def sent(self):
+        kwargs = self._put.call_args[1]
+        return kwargs['headers'], kwargs['data']
+
+    def test_accepts_compressed_responses(self):
+        self.assertTrue('gzip' in self.client.headers['Accept-Encoding'])
+
+    def test_large_body_gzipped(self):
+        self.client.put('/tests', description='x' * 500)
+        headers, data = self.sent()
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        body = airbrite.client.decompress(data, 'gzip')
+        self.assertEqual(json.loads(body), {'description': 'x' * 500})
+
+        stats = self.client.stats()
+        self.assertEqual(stats['request_bytes'], len(body))
+        self.assertEqual(stats['request_bytes_sent'], len(data))
+        self.assertTrue(stats['request_bytes_sent'] < stats['request_bytes'])
+
+    def test_small_body_not_gzipped(self):
+        self.client.put('/tests', sku='foo')
+        headers, data = self.sent()
+        self.assertFalse('Content-Encoding' in headers)
+        self.assertEqual(json.loads(data), {'sku': 'foo'})
+
+    def test_response_bytes(self):
+        self._put.return_value.headers = {'Content-Encoding': 'gzip',
+                                          'Content-Length': '7'}
+        self.client.put('/tests')
+        stats = self.client.stats()
+        self.assertEqual(stats['response_bytes'], len('{"data": {}}'))
+        self.assertEqual(stats['response_bytes_received'], 7)
+
+    def test_decompress(self):
+        data = 'some data ' * 10
+        self.assertEqual(airbrite.client.decompress(
+            airbrite.client.compress(data), 'gzip'), data)
+        self.assertEqual(airbrite.client.decompress(
+            zlib.compress(data), 'deflate'), data)
+        self.assertEqual(airbrite.client.decompress(data, None), data)
@@ -1,8 +1,12 @@
+import copy
+import datetime
+import gc
+import pickle
 import unittest
 import airbrite
 import mock
 
-from utils import TestClient
+from utils import TestClient, PagingClient
 
 
 class ProductTestCase(unittest.TestCase):
@@ -118,7 +122,7 @@ class ProductTestCase(unittest.TestCase):
         self.assertEqual(len(airbrite.Product.client._posted), 1)
         self.assertTrue(product.is_persisted)
 
-        product.save()
+        product.save(full=True)
         self.assertEqual(len(airbrite.Product.client._posted), 1)
         self.assertEqual(len(airbrite.Product.client._put), 1)
         self.assertTrue(product.is_persisted)
@@ -131,6 +135,101 @@ class ProductTestCase(unittest.TestCase):
         self.assertIsInstance(products[0], airbrite.Product)
         self.assertIsInstance(products[1], airbrite.Product)
 
+    def test_refresh_not_modified(self):
+        product = airbrite.Product._from_backend(dict(self.DATA1))
+        data = product.to_dict()
+        airbrite.Product.client.get_if_modified = mock.MagicMock(
+            return_value=None)
+        product.refresh()
+        airbrite.Product.client.get_if_modified.assert_called_once_with(
+            product.instance_url(), updated=self.DATA1['updated'])
+        self.assertIs(product.to_dict(), data)
+
+    def test_refresh_changed_unconditional(self):
+        product = airbrite.Product._from_backend(dict(self.DATA1))
+        product.name = 'changed'
+        airbrite.Product.client.get_if_modified = mock.MagicMock(
+            return_value={'data': dict(self.DATA1)})
+        product.refresh()
+        airbrite.Product.client.get_if_modified.assert_called_once_with(
+            product.instance_url(), updated=None)
+        self.assertEqual(product.name, self.DATA1['name'])
+
+    def test_fetch_many(self):
+        products, errors = airbrite.Product.fetch_many(
+            [self.DATA1['_id'], self.DATA2['_id']], concurrency=2)
+        self.assertEqual(errors, {})
+        self.assertEqual(len(products), 2)
+        self.assertIsInstance(products[0], airbrite.Product)
+
+    def test_fetch_many_partial_failure(self):
+        get = airbrite.Product.client.get
+
+        def failing_get(url, **data):
+            if url.endswith('/missing'):
+                raise Exception('Bad get parameters')
+            return get(url, **data)
+        airbrite.Product.client.get = failing_get
+
+        products, errors = airbrite.Product.fetch_many(
+            [self.DATA1['_id'], 'missing', self.DATA2['_id']])
+        self.assertIsInstance(products[0], airbrite.Product)
+        self.assertIsNone(products[1])
+        self.assertIsInstance(products[2], airbrite.Product)
+        self.assertEqual(list(errors), ['missing'])
+
+    def test_create_many(self):
+        records = [{'sku': 'sku-%d' % i} for i in range(5)]
+        products, errors = airbrite.Product.create_many(records,
+                                                        concurrency=2)
+        self.assertEqual(errors, {})
+        self.assertEqual([p.sku for p in products],
+                         [r['sku'] for r in records])
+        self.assertEqual(len(airbrite.Product.client._posted), 5)
+
+    def test_create_many_partial_failure(self):
+        post = airbrite.Product.client.post
+
+        def failing_post(url, **data):
+            if data['sku'] == 'bad':
+                raise Exception('Bad get parameters')
+            return post(url, **data)
+        airbrite.Product.client.post = failing_post
+
+        products, errors = airbrite.Product.create_many(
+            [{'sku': 'good'}, {'sku': 'bad'}])
+        self.assertEqual(products[0].sku, 'good')
+        self.assertIsNone(products[1])
+        self.assertEqual(list(errors), [1])
+
+    def test_save_many(self):
+        new = airbrite.Product(sku='new')
+        existing = airbrite.Product(_id='some-id', sku='existing')
+        products, errors = airbrite.Product.save_many([new, existing])
+        self.assertEqual(errors, {})
+        self.assertEqual(products, [new, existing])
+        self.assertTrue(new.is_persisted)
+        self.assertEqual(len(airbrite.Product.client._posted), 1)
+        self.assertEqual(len(airbrite.Product.client._put), 1)
+
+    def test_afetch(self):
+        future = airbrite.Product.afetch(_id=self.DATA1['_id'])
+        product = future.result()
+        self.assertIsInstance(product, airbrite.Product)
+        self.assertEqual(product.user_id, self.DATA1['user_id'])
+
+    def test_alist(self):
+        products, paging = airbrite.Product.alist().result()
+        self.assertEqual(len(products), 2)
+        self.assertEqual(paging['total'], 2)
+
+    def test_acreate_and_asave(self):
+        product = airbrite.Product.acreate(sku='foo').result()
+        self.assertEqual(product.sku, 'foo')
+        product.name = 'a new name'
+        self.assertIs(product.asave().result(), product)
+        self.assertEqual(len(airbrite.Product.client._put), 1)
+
 
 class ListProductTestCase(unittest.TestCase):
 
@@ -175,6 +274,60 @@ class ListProductTestCase(unittest.TestCase):
         airbrite.Product.client = c
 
 
+class IterProductTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(IterProductTestCase, self).setUp()
+        self._client = airbrite.Product.client
+        airbrite.Product.client = PagingClient(airbrite.Product, 25)
+
+    def tearDown(self):
+        super(IterProductTestCase, self).tearDown()
+        airbrite.Product.client = self._client
+
+    def test_iter_all(self):
+        products = list(airbrite.Product.iter_all(limit=10))
+        self.assertEqual(len(products), 25)
+        self.assertIsInstance(products[0], airbrite.Product)
+        self.assertEqual([p._id for p in products],
+                         [r['_id'] for r in airbrite.Product.client.records])
+        self.assertEqual(airbrite.Product.client.requested,
+                         [(0, 10), (10, 10), (20, 10)])
+
+    def test_iter_all_is_lazy(self):
+        products = airbrite.Product.iter_all(limit=10, prefetch=1)
+        next(products)
+        # The first page, plus the one prefetched in the background
+        self.assertEqual(len(airbrite.Product.client.requested), 2)
+        products.close()
+
+    def test_get_products(self):
+        self.assertEqual(len(list(airbrite.get_products(limit=7))), 25)
+
+    def test_stream(self):
+        stream = airbrite.Product.stream(limit=10, offset=20)
+        self.assertIsNone(stream.paging)
+        products = list(stream)
+        self.assertIsInstance(products[0], airbrite.Product)
+        self.assertEqual([p._id for p in products],
+                         [r['_id'] for r in
+                          airbrite.Product.client.records[20:]])
+        self.assertEqual(stream.paging['total'], 25)
+
+    def test_list_all_parallel(self):
+        products = list(airbrite.Product.list_all_parallel(concurrency=2,
+                                                           limit=10))
+        self.assertEqual([p._id for p in products],
+                         [r['_id'] for r in airbrite.Product.client.records])
+        self.assertEqual(sorted(airbrite.Product.client.requested),
+                         [(0, 10), (10, 10), (20, 10)])
+
+    def test_list_all_parallel_unordered(self):
+        products = airbrite.Product.list_all_parallel(ordered=False, limit=4)
+        self.assertEqual(sorted(p._id for p in products),
+                         [r['_id'] for r in airbrite.Product.client.records])
+
+
 class OrderTestCase(unittest.TestCase):
     """Test the actual Order, not its REST endpoint functionality"""
     DATA1 = TestClient.CANNED[airbrite.Order][0]
@@ -293,7 +446,7 @@ class OrderTestCase(unittest.TestCase):
         self.assertEqual(len(airbrite.Order.client._posted), 1)
         self.assertTrue(order.is_persisted)
 
-        order.save()
+        order.save(full=True)
         self.assertEqual(len(airbrite.Order.client._posted), 1)
         self.assertEqual(len(airbrite.Order.client._put), 1)
         self.assertTrue(order.is_persisted)
@@ -416,6 +569,14 @@ class ShipmentTestCase(unittest.TestCase):
         self.assertEqual(shipment._id, self.SHIP1['_id'])
         self.assertEqual(shipment.order_id, self.SHIP1['order_id'])
 
+    def test_fetch_many(self):
+        keys = [(self.ORDER['_id'], self.SHIP1['_id']),
+                (self.ORDER['_id'], self.SHIP2['_id'])]
+        shipments, errors = airbrite.Shipment.fetch_many(keys)
+        self.assertEqual(errors, {})
+        self.assertEqual(len(shipments), 2)
+        self.assertIsInstance(shipments[1], airbrite.Shipment)
+
     def test_refresh(self):
         shipment = airbrite.Shipment(_id=self.SHIP1['_id'],
                                      order_id=self.SHIP1['order_id'])
@@ -488,7 +649,7 @@ class ShipmentTestCase(unittest.TestCase):
         self.assertEqual(len(airbrite.Shipment.client._posted), 1)
         self.assertTrue(shipment.is_persisted)
 
-        shipment.save()
+        shipment.save(full=True)
         self.assertEqual(len(airbrite.Shipment.client._posted), 1)
         self.assertEqual(len(airbrite.Shipment.client._put), 1)
         self.assertTrue(shipment.is_persisted)
@@ -613,7 +774,7 @@ class CustomerTestCase(unittest.TestCase):
         self.assertEqual(len(airbrite.Customer.client._posted), 1)
         self.assertTrue(customer.is_persisted)
 
-        customer.save()
+        customer.save(full=True)
         self.assertEqual(len(airbrite.Customer.client._posted), 1)
         self.assertEqual(len(airbrite.Customer.client._put), 1)
         self.assertTrue(customer.is_persisted)
@@ -668,3 +829,210 @@ class ListCustomerTestCase(unittest.TestCase):
         self.assertIsInstance(customers[1], airbrite.Customer)
 
         airbrite.Customer.client = c
+
+
+class CompactTestCase(unittest.TestCase):
+    """Compact entities behave as the regular ones"""
+
+    def setUp(self):
+        super(CompactTestCase, self).setUp()
+        self._client = airbrite.Product.client
+        airbrite.Product.client = TestClient(airbrite.Product)
+
+    def tearDown(self):
+        super(CompactTestCase, self).tearDown()
+        airbrite.Product.client = self._client
+
+    def test_round_trip(self):
+        for entity in (airbrite.Product, airbrite.Order, airbrite.Customer,
+                       airbrite.Shipment):
+            for data in TestClient.CANNED[entity]:
+                compact = entity.compact()(**copy.deepcopy(data))
+                self.assertEqual(compact.to_dict(),
+                                 entity(**copy.deepcopy(data)).to_dict())
+
+    def test_compact_class(self):
+        CompactProduct = airbrite.Product.compact()
+        self.assertTrue(CompactProduct is airbrite.Product.compact())
+        self.assertTrue(CompactProduct.compact() is CompactProduct)
+        product = CompactProduct(_id='foo')
+        self.assertIsInstance(product, airbrite.Product)
+        self.assertEqual(product, airbrite.Product(_id='foo'))
+
+    def test_attributes(self):
+        data = copy.deepcopy(TestClient.CANNED[airbrite.Product][0])
+        product = airbrite.Product.compact()(**data)
+        self.assertEqual(product.sku, 'first-product')
+        self.assertIsNone(product.price)
+        product.sku = 'renamed'
+        product.metadata['color'] = 'blue'
+        self.assertEqual(product.to_dict()['sku'], 'renamed')
+        self.assertEqual(product.to_dict()['metadata'], {'color': 'blue'})
+        # Undeclared fields are kept too
+        self.assertEqual(product.to_dict()['weight'], None)
+        # Defaults are stored on access, as for regular entities
+        self.assertTrue('price' in product.to_dict())
+
+    def test_no_instance_dict(self):
+        product = airbrite.Product.compact()(_id='foo', sku='bar')
+        product.sku = 'baz'
+        self.assertFalse(any(isinstance(ref, dict)
+                             for ref in gc.get_referents(product)))
+
+    def test_collections(self):
+        order = airbrite.Order.compact()(
+            **copy.deepcopy(TestClient.CANNED[airbrite.Order][0]))
+        order.shipments.add(airbrite.Shipment(_id='s', courier='UPS'))
+        order.add_item(airbrite.Product(sku='foo'))
+        self.assertEqual(order.to_dict()['shipments'][0]['courier'], 'UPS')
+        self.assertEqual(len(order.line_items), 2)
+
+    def test_customer_replace(self):
+        customer = airbrite.Customer.compact()(
+            **copy.deepcopy(TestClient.CANNED[airbrite.Customer][0]))
+        self.assertEqual(customer.stripe_customer_id, 'cus_2q0hhWrrcLHZci')
+
+    def test_list_and_pickle(self):
+        products, _ = airbrite.Product.compact().list()
+        self.assertEqual(type(products[0]), airbrite.Product.compact())
+        restored = pickle.loads(pickle.dumps(products[0], 2))
+        self.assertEqual(restored.to_dict(), products[0].to_dict())
+
+
+class ChangesTestCase(unittest.TestCase):
+    """save() sends only what changed since the last sync"""
+
+    def setUp(self):
+        super(ChangesTestCase, self).setUp()
+        self._clients = (airbrite.Product.client, airbrite.Order.client)
+        airbrite.Product.client = TestClient(airbrite.Product)
+        airbrite.Order.client = TestClient(airbrite.Order)
+
+    def tearDown(self):
+        super(ChangesTestCase, self).tearDown()
+        airbrite.Product.client, airbrite.Order.client = self._clients
+
+    def fetch(self, entity):
+        # As fetched, without sharing the canned data
+        data = copy.deepcopy(TestClient.CANNED[entity][0])
+        return entity._from_backend(data)
+
+    def test_unknown_changes(self):
+        product = airbrite.Product(_id='foo', sku='bar')
+        self.assertIsNone(product.changes())
+        product.save()
+        self.assertEqual(airbrite.Product.client._put,
+                         [{'_id': 'foo', 'sku': 'bar'}])
+
+    def test_assigned_fields(self):
+        product = self.fetch(airbrite.Product)
+        self.assertEqual(product.changes(), {})
+        product.name = 'new name'
+        product.created = datetime.datetime(2014, 1, 1)
+        changes = product.changes()
+        self.assertEqual(sorted(changes), ['created', 'created_date', 'name'])
+        product.save()
+        self.assertEqual(airbrite.Product.client._put, [changes])
+        self.assertEqual(product.changes(), {})
+        # The fields not sent are kept
+        self.assertEqual(product.sku, 'first-product')
+
+    def test_changed_in_place(self):
+        product = self.fetch(airbrite.Product)
+        product.metadata['color'] = 'blue'
+        self.assertEqual(product.changes(),
+                         {'metadata': {'color': 'blue'}})
+
+    def test_read_is_not_a_change(self):
+        product = self.fetch(airbrite.Product)
+        product.metadata, product.sku
+        self.assertEqual(product.changes(), {})
+        product.save()
+        self.assertEqual(airbrite.Product.client._put, [])
+
+    def test_default_changed_in_place(self):
+        data = copy.deepcopy(TestClient.CANNED[airbrite.Product][0])
+        del data['metadata']
+        product = airbrite.Product._from_backend(data)
+        product.metadata
+        self.assertEqual(product.changes(), {})
+        product.metadata['color'] = 'blue'
+        self.assertEqual(product.changes(),
+                         {'metadata': {'color': 'blue'}})
+
+    def test_collections(self):
+        order = self.fetch(airbrite.Order)
+        order.add_item(airbrite.Product(sku='foo'))
+        order.payments.add(airbrite.Payment(amount=100))
+        self.assertEqual(sorted(order.changes()), ['line_items', 'payments'])
+
+    def test_full(self):
+        product = self.fetch(airbrite.Product)
+        product.name = 'new name'
+        product.save(full=True)
+        self.assertEqual(airbrite.Product.client._put, [product.to_dict()])
+
+    def test_compact(self):
+        product = airbrite.Product.compact()._from_backend(
+            copy.deepcopy(TestClient.CANNED[airbrite.Product][0]))
+        product.sku = 'renamed'
+        self.assertEqual(product.changes(), {'sku': 'renamed'})
+
+
+class DatesTestCase(unittest.TestCase):
+
+    class UTCPlus3 (datetime.tzinfo):
+
+        def utcoffset(self, dt):
+            return datetime.timedelta(hours=3)
+
+        def dst(self, dt):
+            return datetime.timedelta(0)
+
+    def product(self, **data):
+        return airbrite.Product(**dict(
+            copy.deepcopy(TestClient.CANNED[airbrite.Product][0]), **data))
+
+    def test_utc(self):
+        product = self.product()
+        self.assertEqual(product.created,
+                         datetime.datetime(2013, 9, 17, 0, 40, 36))
+        product.created = product.created
+        self.assertEqual(product.to_dict()['created'], 1379378436)
+
+    def test_memoized(self):
+        product = self.product()
+        self.assertTrue(product.created is product.created)
+
+    def test_invalidated(self):
+        for entity in (airbrite.Product, airbrite.Product.compact()):
+            product = entity(created=1379378436, created_date='')
+            product.created
+            product.created = datetime.datetime(2014, 1, 2, 3, 4, 5, 6000)
+            self.assertEqual(product.created,
+                             datetime.datetime(2014, 1, 2, 3, 4, 5))
+            self.assertEqual(product.to_dict()['created_date'],
+                             '2014-01-02T03:04:05.006Z')
+            product.replace({'created': 0})
+            self.assertEqual(product.created, datetime.datetime(1970, 1, 1))
+
+    def test_aware(self):
+        product = self.product()
+        product.created = datetime.datetime(2014, 1, 1, 3,
+                                            tzinfo=self.UTCPlus3())
+        self.assertEqual(product.created, datetime.datetime(2014, 1, 1))
+        self.assertEqual(product.to_dict()['created_date'],
+                         '2014-01-01T00:00:00.000Z')
+
+    def test_missing(self):
+        self.assertIsNone(airbrite.Product(sku='foo').created)
+
+    def test_datetimes(self):
+        products = [self.product(created=1379378436 + i % 2)
+                    for i in range(10)]
+        dates = airbrite.api.datetimes(products)
+        self.assertEqual(dates, [p.created for p in products])
+        self.assertTrue(dates[0] is dates[2])
+        self.assertTrue(products[1].created is dates[1])
+        self.assertEqual(airbrite.api.datetimes(products, name='updated')[0],
+                         datetime.datetime(2013, 9, 17, 0, 40, 36))
@@ -0,0 +1,78 @@
+import unittest
+import airbrite
+import airbrite.mirror
+import airbrite.sync
+
+from utils import TestClient, PagingClient
+
+
+class MirrorTestCase (unittest.TestCase):
+
+    PRODUCTS = TestClient.CANNED[airbrite.Product]
+    ORDERS = TestClient.CANNED[airbrite.Order]
+
+    def setUp(self):
+        super(MirrorTestCase, self).setUp()
+        self.mirror = airbrite.mirror.Mirror()
+        self.mirror.add(airbrite.Product(**data) for data in self.PRODUCTS)
+        self.mirror.add(airbrite.Order(**data) for data in self.ORDERS)
+
+    def tearDown(self):
+        super(MirrorTestCase, self).tearDown()
+        self.mirror.close()
+
+    def test_get(self):
+        product = self.mirror.get(airbrite.Product, self.PRODUCTS[0]['_id'])
+        self.assertIsInstance(product, airbrite.Product)
+        self.assertEqual(product.to_dict(), self.PRODUCTS[0])
+        self.assertIsNone(self.mirror.get(airbrite.Order,
+                                          self.PRODUCTS[0]['_id']))
+
+    def test_find_by_sku(self):
+        products = self.mirror.find(airbrite.Product, sku='second-product')
+        self.assertEqual([p._id for p in products],
+                         [self.PRODUCTS[1]['_id']])
+
+    def test_find_ordered(self):
+        orders = self.mirror.find(airbrite.Order, order_by='-created')
+        self.assertEqual([o.order_number for o in orders], [3442, 3441])
+        orders = self.mirror.find(airbrite.Order, order_by='created',
+                                  limit=1)
+        self.assertEqual([o.order_number for o in orders], [3441])
+
+    def test_find_since(self):
+        orders = self.mirror.find(airbrite.Order, since=1380735880)
+        self.assertEqual([o.order_number for o in orders], [3442])
+
+    def test_find_unindexed(self):
+        self.assertRaises(ValueError, self.mirror.find, airbrite.Order,
+                          status='paid')
+
+    def test_compact_same_kind(self):
+        compact = airbrite.Product.compact()
+        data = dict(self.PRODUCTS[0], sku='compact-product')
+        self.assertEqual(self.mirror.merge(compact(**data)), 'updated')
+        products = self.mirror.find(airbrite.Product, sku='compact-product')
+        self.assertEqual([p._id for p in products], [data['_id']])
+        self.assertEqual(self.mirror.count(compact), len(self.PRODUCTS))
+
+    def test_merge(self):
+        order = airbrite.Order(**self.ORDERS[0])
+        self.assertIsNone(self.mirror.merge(order))
+        order.status = 'shipped'
+        self.assertEqual(self.mirror.merge(order), 'updated')
+        self.assertEqual(
+            self.mirror.get(airbrite.Order, order._id).status, 'shipped')
+        self.assertEqual(self.mirror.count(airbrite.Order), 2)
+
+    def test_sync_into_mirror(self):
+        client = airbrite.Customer.client
+        airbrite.Customer.client = PagingClient(airbrite.Customer, 3)
+        try:
+            syncer = airbrite.sync.Syncer(airbrite.Customer,
+                                          airbrite.sync.Checkpoints(),
+                                          self.mirror)
+            self.assertEqual(len(syncer.sync()['created']), 3)
+        finally:
+            airbrite.Customer.client = client
+        self.assertEqual(self.mirror.count(airbrite.Customer), 3)
@@ -0,0 +1,160 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import mock
+
+import airbrite.client
+import airbrite.ratelimit
+
+
+class Clock (object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class RateLimiterTestCase (unittest.TestCase):
+
+    def setUp(self):
+        super(RateLimiterTestCase, self).setUp()
+        self.clock = Clock()
+
+    def limiter(self, **kwargs):
+        return airbrite.ratelimit.RateLimiter(clock=self.clock, **kwargs)
+
+    def test_burst(self):
+        limiter = self.limiter(rate=2, burst=3)
+        waits = [limiter.reserve('get') for _ in range(5)]
+        self.assertEqual(waits, [0, 0, 0, 0.5, 1.0])
+
+    def test_refill(self):
+        limiter = self.limiter(rate=2, burst=1)
+        self.assertEqual(limiter.reserve('get'), 0)
+        self.clock.now += 0.5
+        self.assertEqual(limiter.reserve('get'), 0)
+
+    def test_per_method_and_key(self):
+        limiter = self.limiter(rate=1, per_method={'post': (1, 2)})
+        self.assertEqual(limiter.reserve('get', 'key1'), 0)
+        self.assertEqual(limiter.reserve('get', 'key2'), 0)
+        self.assertEqual(limiter.reserve('post', 'key1'), 0)
+        self.assertEqual(limiter.reserve('post', 'key1'), 0)
+        self.assertEqual(limiter.reserve('get', 'key1'), 1.0)
+
+
+class FileBackendTestCase (RateLimiterTestCase):
+
+    def setUp(self):
+        super(FileBackendTestCase, self).setUp()
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'rate.json')
+
+    def tearDown(self):
+        super(FileBackendTestCase, self).tearDown()
+        shutil.rmtree(self.dir)
+
+    def limiter(self, **kwargs):
+        # A new backend per limiter, as separate processes would have
+        return airbrite.ratelimit.RateLimiter(
+            clock=self.clock,
+            backend=airbrite.ratelimit.FileBackend(self.path), **kwargs)
+
+    def test_shared_between_limiters(self):
+        self.assertEqual(self.limiter(rate=1).reserve('get'), 0)
+        self.assertEqual(self.limiter(rate=1).reserve('get'), 1.0)
+
+
+class ClientThrottleTestCase (unittest.TestCase):
+
+    def test_throttles_requests(self):
+        clock = Clock()
+        client = airbrite.client.Client(
+            rate_limiter=airbrite.ratelimit.RateLimiter(rate=1, clock=clock))
+        client.sleep = mock.MagicMock()
+        with mock.patch('requests.Session.get') as get:
+            get.return_value.status_code = 200
+            get.return_value.content = '{}'
+            client.get('/tests')
+            client.get('/tests', limit=1)
+        client.sleep.assert_called_once_with(1.0)
+        self.assertEqual(client.stats()['throttled'], 1)
+
+
+class AdaptiveConcurrencyTestCase (unittest.TestCase):
+
+    def setUp(self):
+        super(AdaptiveConcurrencyTestCase, self).setUp()
+        self.clock = Clock()
+        self.limiter = airbrite.ratelimit.AdaptiveConcurrency(
+            initial=4, minimum=1, maximum=5, latency_target=1.0,
+            clock=self.clock)
+
+    def complete(self, n, latency=0.1, ok=True):
+        for _ in range(n):
+            self.limiter.acquire()
+            self.limiter.release(latency, ok)
+
+    def test_additive_increase(self):
+        self.complete(4)
+        self.assertEqual(int(self.limiter.window), 4)
+        self.complete(1)
+        self.assertEqual(int(self.limiter.window), 5)
+        self.complete(20)
+        self.assertEqual(self.limiter.window, 5)
+
+    def test_multiplicative_decrease(self):
+        self.complete(1, ok=False)
+        self.assertEqual(self.limiter.window, 2)
+        # Once per congestion event
+        self.complete(1, latency=3)
+        self.assertEqual(self.limiter.window, 2)
+        self.clock.now += 1
+        self.complete(1, latency=3)
+        self.assertEqual(self.limiter.window, 1)
+        self.clock.now += 1
+        self.complete(1, ok=False)
+        self.assertEqual(self.limiter.window, 1)
+
+    def test_caps_in_flight(self):
+        for _ in range(4):
+            self.limiter.acquire()
+        self.assertEqual(self.limiter.in_flight, 4)
+        thread = threading.Thread(target=self.limiter.acquire)
+        thread.start()
+        thread.join(0.05)
+        self.assertTrue(thread.is_alive())
+        self.limiter.release(0.1)
+        thread.join()
+        self.assertEqual(self.limiter.in_flight, 4)
+
+    def test_acquire_timeout(self):
+        for _ in range(4):
+            self.limiter.acquire()
+        self.assertFalse(self.limiter.acquire(timeout=0.01))
+        self.assertEqual(self.limiter.in_flight, 4)
+        self.limiter.release(0.1)
+        self.assertTrue(self.limiter.acquire(timeout=0.01))
+
+    def test_client_waits_within_deadline(self):
+        client = airbrite.client.Client(concurrency=self.limiter)
+        for _ in range(4):
+            self.limiter.acquire()
+        with mock.patch('requests.Session.get') as get:
+            with airbrite.deadline(0.05):
+                self.assertRaises(airbrite.DeadlineExceeded, client.get,
+                                  '/tests')
+            self.assertFalse(get.called)
+
+    def test_client_reports_window(self):
+        client = airbrite.client.Client(concurrency=self.limiter)
+        with mock.patch('requests.Session.get') as get:
+            get.return_value.status_code = 503
+            client.sleep = mock.MagicMock()
+            self.assertRaises(Exception, client.get, '/tests')
+        self.assertEqual(client.stats()['concurrency_window'], 2)
+        self.assertEqual(client.stats()['in_flight'], 0)
@@ -0,0 +1,75 @@
+import json
+import unittest
+
+from airbrite.stream import ListStream
+
+
+class ListStreamTestCase (unittest.TestCase):
+
+    BODY = {
+        'data': [{'_id': str(i), 'line_items': [{'sku': u'caf\xe9',
+                                                 'quantity': i}],
+                  'total': i * 1.5} for i in range(50)],
+        'paging': {'count': 50, 'has_more': False, 'total': 50},
+        'meta': {},
+    }
+
+    def chunked(self, body, size):
+        return [body[i:i + size] for i in range(0, len(body), size)]
+
+    def test_chunk_sizes(self):
+        body = json.dumps(self.BODY, indent=1)
+        for size in (1, 7, 64, len(body)):
+            stream = ListStream(self.chunked(body, size))
+            self.assertEqual(list(stream), self.BODY['data'])
+            self.assertEqual(stream.paging, self.BODY['paging'])
+            self.assertEqual(stream.meta, {})
+
+    def test_paging_before_data(self):
+        body = '{"paging": {"total": 2}, "data": [1, 23]}'
+        stream = ListStream(self.chunked(body, 3))
+        self.assertEqual(next(stream), 1)
+        self.assertEqual(stream.paging, {'total': 2})
+        self.assertEqual(list(stream), [23])
+
+    def test_yields_while_parsing(self):
+        chunks = iter(self.chunked(json.dumps(self.BODY), 16))
+        stream = ListStream(chunks)
+        next(stream)
+        self.assertTrue(len(list(chunks)) > 0)
+
+    def test_item(self):
+        stream = ListStream([json.dumps(self.BODY)],
+                            item=lambda data: data['_id'])
+        self.assertEqual(list(stream), [str(i) for i in range(50)])
+
+    def test_empty(self):
+        self.assertEqual(list(ListStream(['{"data": [], "paging": {}}'])), [])
+        self.assertEqual(list(ListStream(['{}'])), [])
+
+    def test_truncated(self):
+        body = json.dumps(self.BODY)
+        stream = ListStream(self.chunked(body[:-40], 10))
+        self.assertRaises(ValueError, list, stream)
+
+    def test_closes(self):
+        closed = []
+        stream = ListStream([json.dumps(self.BODY)],
+                            close=lambda: closed.append(True))
+        list(stream)
+        self.assertEqual(closed, [True])
+
+        stream = ListStream([json.dumps(self.BODY)],
+                            close=lambda: closed.append(True))
+        next(stream)
+        stream.close()
+        self.assertEqual(closed, [True, True])
+
+    def test_closes_unread(self):
+        closed = []
+        stream = ListStream([json.dumps(self.BODY)],
+                            close=lambda: closed.append(True))
+        stream.close()
+        stream.close()
+        self.assertEqual(closed, [True])
+        self.assertEqual(list(stream), [])
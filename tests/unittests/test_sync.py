@@ -0,0 +1,135 @@
+import os
+import shutil
+import tempfile
+import unittest
+import airbrite
+import airbrite.client
+import airbrite.sync
+import airbrite.transport
+
+from utils import PagingClient
+
+
+class SyncTestCase (unittest.TestCase):
+
+    def setUp(self):
+        super(SyncTestCase, self).setUp()
+        self._client = airbrite.Order.client
+        self.client = PagingClient(airbrite.Order, 5)
+        airbrite.Order.client = self.client
+
+        self.checkpoints = airbrite.sync.Checkpoints()
+        self.store = airbrite.sync.MemoryStore()
+        self.syncer = airbrite.sync.Syncer(airbrite.Order, self.checkpoints,
+                                           self.store)
+
+    def tearDown(self):
+        super(SyncTestCase, self).tearDown()
+        airbrite.Order.client = self._client
+
+    def test_first_sync(self):
+        delta = self.syncer.sync()
+        self.assertEqual(len(delta['created']), 5)
+        self.assertEqual(delta['updated'], [])
+        self.assertEqual(delta['checkpoint'], 1380000004)
+        self.assertEqual(self.checkpoints.get('Order'), 1380000004)
+        self.assertEqual(len(self.store.all(airbrite.Order)), 5)
+
+    def test_compact_shares_checkpoint(self):
+        self.syncer.sync()
+        syncer = airbrite.sync.Syncer(airbrite.Order.compact(),
+                                      self.checkpoints, self.store)
+        self.assertEqual(syncer.key, 'Order')
+        delta = syncer.sync()
+        self.assertEqual(delta['created'], [])
+        self.assertEqual(delta['updated'], [])
+
+    def test_incremental_sync(self):
+        self.syncer.sync()
+        self.client.records[1]['updated'] = 1380000010
+        self.client.records[1]['status'] = 'shipped'
+        self.client.records.append({'_id': 'new', 'updated': 1380000011})
+
+        delta = self.syncer.sync()
+        self.assertEqual(delta['created'], ['new'])
+        self.assertEqual(delta['updated'], ['id-00001'])
+        self.assertEqual(delta['checkpoint'], 1380000011)
+        order = self.store.get(airbrite.Order, 'id-00001')
+        self.assertEqual(order.status, 'shipped')
+
+    def test_nothing_changed(self):
+        self.syncer.sync()
+        delta = self.syncer.sync()
+        self.assertEqual(delta['created'], [])
+        self.assertEqual(delta['updated'], [])
+
+
+class SyncWhileUpdatedTestCase (unittest.TestCase):
+    """Entities updated during a sync don't make it skip others"""
+
+    def setUp(self):
+        super(SyncWhileUpdatedTestCase, self).setUp()
+        self._client = airbrite.Product.__dict__.get('client')
+        self.now = 1380000000
+        self.client = airbrite.client.Client(
+            transport=airbrite.transport.MemoryTransport(
+                clock=lambda: self.now))
+        airbrite.Product.client = self.client
+        self.products = []
+        for i in range(5):
+            self.now += 1
+            self.products.append(airbrite.Product.create(sku='p%d' % i))
+
+        self.store = airbrite.sync.MemoryStore()
+        self.syncer = airbrite.sync.Syncer(
+            airbrite.Product, airbrite.sync.Checkpoints(), self.store,
+            page_size=2)
+
+    def tearDown(self):
+        super(SyncWhileUpdatedTestCase, self).tearDown()
+        if self._client is None:
+            del airbrite.Product.client
+        else:
+            airbrite.Product.client = self._client
+        self.client.close()
+
+    def test_updated_mid_scan(self):
+        merge = self.store.merge
+
+        def merge_and_update(entity):
+            if entity.sku == 'p1':
+                # After the first page, p0 moves to the end
+                self.now += 1
+                self.products[0].name = 'updated'
+                self.products[0].save()
+            return merge(entity)
+        self.store.merge = merge_and_update
+
+        delta = self.syncer.sync()
+        self.assertEqual(sorted(p.sku for p in
+                                self.store.all(airbrite.Product)),
+                         ['p0', 'p1', 'p2', 'p3', 'p4'])
+        self.assertEqual(delta['updated'], [self.products[0]._id])
+        self.assertEqual(delta['checkpoint'], self.now)
+
+    def test_same_timestamp_pages(self):
+        for i in range(5, 10):
+            airbrite.Product.create(sku='p%d' % i)
+        self.syncer.sync()
+        self.assertEqual(len(self.store.all(airbrite.Product)), 10)
+
+
+class FileCheckpointsTestCase (unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'checkpoints.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_persisted(self):
+        airbrite.sync.FileCheckpoints(self.path).set('Product', 1380000000)
+        checkpoints = airbrite.sync.FileCheckpoints(self.path)
+        self.assertEqual(checkpoints.get('Product'), 1380000000)
+        self.assertIsNone(checkpoints.get('Order'))
@@ -0,0 +1,135 @@
+import unittest
+import airbrite
+import airbrite.cache
+import airbrite.client
+import airbrite.transport
+
+
+class MemoryTransportTestCase (unittest.TestCase):
+    """Run the entities against the in-memory Airbrite stand-in"""
+
+    ENTITIES = (airbrite.Product, airbrite.Order, airbrite.Customer,
+                airbrite.Shipment)
+
+    def setUp(self):
+        super(MemoryTransportTestCase, self).setUp()
+        self.transport = airbrite.transport.MemoryTransport()
+        self.client = airbrite.client.Client(transport=self.transport)
+        self._clients = dict((e, e.__dict__.get('client'))
+                             for e in self.ENTITIES)
+        for entity in self.ENTITIES:
+            entity.client = self.client
+
+    def tearDown(self):
+        super(MemoryTransportTestCase, self).tearDown()
+        for entity, client in self._clients.items():
+            if client is None:
+                del entity.client
+            else:
+                entity.client = client
+        self.client.close()
+
+    def test_create_and_fetch(self):
+        product = airbrite.Product.create(sku='foo', price=150)
+        self.assertTrue(product.is_persisted)
+        fetched = airbrite.Product.fetch(_id=product._id)
+        self.assertEqual(fetched.sku, 'foo')
+        self.assertEqual(fetched.created, product.created)
+
+    def test_update(self):
+        customer = airbrite.Customer(name='Joe')
+        customer.save()
+        customer.name = 'Joe Doe'
+        customer.save()
+        self.assertEqual(airbrite.Customer.fetch(_id=customer._id).name,
+                         'Joe Doe')
+
+    def test_not_found(self):
+        self.assertRaises(Exception, airbrite.Product.fetch, _id='missing')
+
+    def test_paging(self):
+        airbrite.Product.create_many([{'sku': str(i)} for i in range(25)])
+        products, paging = airbrite.Product.list(limit=10, offset=20)
+        self.assertEqual(len(products), 5)
+        self.assertEqual(paging['total'], 25)
+        self.assertFalse(paging['has_more'])
+        skus = [p.sku for p in airbrite.Product.iter_all(limit=7)]
+        self.assertEqual(sorted(skus, key=int), [str(i) for i in range(25)])
+
+    def test_nested_fan_out(self):
+        airbrite.Product.create_many([{'sku': str(i)} for i in range(5)])
+        ids = [p._id for p in airbrite.Product.iter_all()]
+        client = airbrite.client.Client(transport=self.transport,
+                                        max_workers=2)
+        airbrite.Product.client = client
+
+        def walk():
+            return len(list(airbrite.Product.iter_all(limit=2)))
+
+        def fetch():
+            products, errors = airbrite.Product.fetch_many(ids)
+            return len(products), errors
+        try:
+            # Fanning out from every worker at once
+            futures = [client.submit(walk), client.submit(walk),
+                       client.submit(fetch)]
+            self.assertEqual(futures[0].result(timeout=10), 5)
+            self.assertEqual(futures[1].result(timeout=10), 5)
+            self.assertEqual(futures[2].result(timeout=10), (5, {}))
+        finally:
+            client.close()
+
+    def test_stream(self):
+        for i in range(25):
+            airbrite.Product.create(sku=str(i))
+        stream = airbrite.Product.stream(limit=20)
+        self.assertEqual([p.sku for p in stream], [str(i) for i in range(20)])
+        self.assertTrue(stream.paging['has_more'])
+        self.assertEqual(self.client.stats()['streamed'], 1)
+
+    def test_compression(self):
+        self.client.compression = airbrite.client.Compression(min_size=100)
+        airbrite.Product.create(sku='foo', description='x' * 2000)
+        products, paging = airbrite.Product.list()
+        self.assertEqual(products[0].description, 'x' * 2000)
+
+        stats = self.client.stats()
+        self.assertTrue(stats['request_bytes_sent'] < stats['request_bytes'])
+        self.assertTrue(stats['response_bytes_received'] <
+                        stats['response_bytes'])
+
+    def test_shipments_in_order(self):
+        order = airbrite.Order.create(line_items=[{'sku': 'foo',
+                                                   'quantity': 1}])
+        shipment = airbrite.Shipment.create(order_id=order._id,
+                                            courier='UPS')
+        self.assertEqual(shipment.order_id, order._id)
+        shipments, paging = airbrite.Shipment.list(order_id=order._id)
+        self.assertEqual([s._id for s in shipments], [shipment._id])
+
+    def test_not_modified(self):
+        product = airbrite.Product.create(sku='foo')
+        product.refresh()
+        product.refresh()
+        self.assertEqual(self.client.stats()['not_modified'], 1)
+
+    def test_refresh_discards_changes(self):
+        airbrite.Product.cache = airbrite.cache.EntityCache()
+        try:
+            product = airbrite.Product.create(sku='foo', name='a')
+            product.name = 'x'
+            product.refresh(cached=False)
+            self.assertEqual(product.name, 'a')
+            self.assertEqual(
+                airbrite.Product.fetch(_id=product._id).name, 'a')
+            # Unchanged data is still revalidated
+            product.refresh(cached=False)
+            self.assertEqual(self.client.stats()['not_modified'], 1)
+        finally:
+            airbrite.Product.cache = None
+
+    def test_idempotent_create(self):
+        first = airbrite.Product.create(sku='foo', idempotency_key='op-1')
+        again = airbrite.Product.create(sku='foo', idempotency_key='op-1')
+        self.assertEqual(first._id, again._id)
+        self.assertEqual(len(airbrite.Product.list()[0]), 1)
@@ -1,7 +1,11 @@
 """
 A client implements get, put, post and
 """
+import json
+import concurrent.futures
+
 from airbrite import Product, Order, Shipment, Payment, Customer
+from airbrite.stream import ListStream
 
 
 class TestClient(object):
@@ -206,6 +210,15 @@ class TestClient(object):
         self.clear_put()
         self.clear_posted()
 
+    def submit(self, fn, *args, **kwargs):
+        # Run the call right away, so tests stay deterministic
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
     def get(self, url, **data):
         # Linsting the products
         if url == self.hint.collection_url():
@@ -228,7 +241,16 @@ class TestClient(object):
         # If any product is acceptable, return any
         return {'data': self.CANNED[self.hint][0]}
 
-    def post(self, url, **data):
+    def stream(self, url, item=None, **data):
+        # Serve the body in small chunks, as a network would
+        body = json.dumps(self.get(url, **data))
+        chunks = [body[i:i + 64] for i in range(0, len(body), 64)]
+        return ListStream(chunks, item=item)
+
+    def get_if_modified(self, url, updated=None, **data):
+        return self.get(url, **data)
+
+    def post(self, url, idempotency_key=None, **data):
         # Prepare a version of the data that is acceptable to return
         posted_data = data.copy()
         posted_data['_id'] = self.hint.__name__ + '_test_id'
@@ -242,3 +264,30 @@ class TestClient(object):
         # Keep a copy for consultancy
         self._put.append(put_data)
         return {'data': put_data}
+
+
+class PagingClient(TestClient):
+    """Serves `total` generated records, honoring `limit` and `offset`"""
+
+    def __init__(self, hint, total):
+        super(PagingClient, self).__init__(hint)
+        self.records = [{'_id': 'id-%05d' % i, 'updated': 1380000000 + i}
+                        for i in range(total)]
+        self.requested = []
+
+    def get(self, url, limit=100, offset=0, since=None, **data):
+        self.requested.append((offset, limit))
+        records = [r for r in self.records
+                   if since is None or r['updated'] >= since]
+        page = records[offset:offset + limit]
+        return {
+            'data': [record.copy() for record in page],
+            'paging': {
+                'count': len(page),
+                'has_more': offset + len(page) < len(records),
+                'limit': limit,
+                'offset': offset,
+                'total': len(records),
+            },
+            'meta': {}
+        }